@@ -15,4 +15,9 @@ chapters: list[BaseChapter] = [
     FirewallChapter(),
 ]  # , PracticeChapter()]
 
-__all__ = ["chapters"]
+
+def get_chapter(slug: str) -> BaseChapter | None:
+    return next((chapter for chapter in chapters if chapter.slug == slug), None)
+
+
+__all__ = ["chapters", "get_chapter"]
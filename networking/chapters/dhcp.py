@@ -1,18 +1,19 @@
+import functools
 import re
 import string
 from datetime import datetime
 from decimal import Decimal
 from random import Random
+from typing import Any, Mapping
 
-from netaddr import IPNetwork
-from starlette.requests import Request
+from netaddr import EUI, IPAddress, IPNetwork
 
 from quirck.box.meta import ContainerNetworkMeta, Deployment, ContainerMeta, NetworkMeta
 
 from networking.core import util
 from networking.core.chapter.base import BaseChapter, ChapterTask
 from networking.core.chapter.docker import DockerMixin
-from networking.core.chapter.form import FormMixin, BaseTaskForm, RegexpForm
+from networking.core.chapter.form import FormMixin, FormTask, RegexpForm
 from networking.core.config import SECRET_SEED
 
 
@@ -54,13 +55,26 @@ ZONES = ["com", "net", "biz", "xn--p1ai"]
 
 
 class DHCPVariant:
-    deployment: Deployment
-    form_classes: list[type[BaseTaskForm]]
+    forms: list[FormTask]
 
     slaac_suffix: str
     http_domain: str
 
-    def __init__(self, user_id: int):
+    user_id: int
+    ip4_net: IPNetwork
+    slaac_net: IPNetwork
+    dhcp6_net: IPNetwork
+    dnsmasq_mac: EUI
+    ping_mac: EUI
+    http_mac: EUI
+    dns_ip: IPAddress
+    http_ip: IPAddress
+    client_ip4: IPAddress
+    dhcp6_ip: IPAddress
+    random_domain: str
+
+    @staticmethod
+    def generate(user_id: int) -> dict[str, Any]:
         rnd = Random(f"{SECRET_SEED}-{user_id}")
 
         ip4_net = util.generate_subnet(rnd, IPNetwork("10.0.0.0/8"), 24)
@@ -72,11 +86,9 @@ class DHCPVariant:
         http_mac = util.generate_mac(rnd)
 
         dns_ip = util.generate_address(rnd, dhcp6_net)
-        http_ip = http_mac.ipv6(slaac_net.value or 0)
         client_ip4 = util.generate_address(rnd, next(ip4_net.subnet(prefixlen=25)))
 
-        self.slaac_suffix = str(ping_mac.ipv6(0))
-        self.http_domain = "".join(
+        http_domain = "".join(
             rnd.choice(string.ascii_lowercase + string.digits) for _ in range(24)
         )
 
@@ -84,22 +96,76 @@ class DHCPVariant:
             f"{rnd.choice(ADJECTIVES)}-{rnd.choice(NOUNS)}.{rnd.choice(ZONES)}"
         )
 
-        self.deployment = Deployment(
+        dhcp6_ip = util.generate_address(rnd, dhcp6_net)
+
+        return {
+            "ip4_net": str(ip4_net),
+            "slaac_net": str(slaac_net),
+            "dhcp6_net": str(dhcp6_net),
+            "dnsmasq_mac": str(dnsmasq_mac),
+            "ping_mac": str(ping_mac),
+            "http_mac": str(http_mac),
+            "dns_ip": str(dns_ip),
+            "client_ip4": str(client_ip4),
+            "http_domain": http_domain,
+            "random_domain": random_domain,
+            "dhcp6_ip": str(dhcp6_ip),
+        }
+
+    def __init__(self, user_id: int, params: Mapping[str, Any]):
+        self.user_id = user_id
+
+        self.ip4_net = IPNetwork(params["ip4_net"])
+        self.slaac_net = IPNetwork(params["slaac_net"])
+        self.dhcp6_net = IPNetwork(params["dhcp6_net"])
+
+        self.dnsmasq_mac = EUI(params["dnsmasq_mac"])
+        self.ping_mac = EUI(params["ping_mac"])
+        self.http_mac = EUI(params["http_mac"])
+
+        self.dns_ip = IPAddress(params["dns_ip"])
+        self.http_ip = self.http_mac.ipv6(self.slaac_net.value or 0)
+        self.client_ip4 = IPAddress(params["client_ip4"])
+        self.dhcp6_ip = IPAddress(params["dhcp6_ip"])
+
+        self.slaac_suffix = str(self.ping_mac.ipv6(0))
+        self.http_domain = params["http_domain"]
+
+        self.random_domain = params["random_domain"]
+
+        self.forms = [
+            RegexpForm.make_task(
+                "net", answer=re.compile(f"^{self.client_ip4}/24$", re.I)
+            ),
+            RegexpForm.make_task("dns", answer=re.compile(f"^{self.http_ip}$", re.I)),
+            RegexpForm.make_task(
+                "domain",
+                answer=re.compile(
+                    f"^{self.random_domain.replace('.', chr(92) + '.')}\\.?$", re.I
+                ),
+            ),
+        ]
+
+    @functools.cached_property
+    def deployment(self) -> Deployment:
+        return Deployment(
             containers=[
-                ContainerMeta.make_vpn(user_id, ["internal"]),
+                ContainerMeta.make_vpn(self.user_id, ["internal"]),
                 ContainerMeta(
                     name="dnsmasq",
                     image="ct-itmo/labs-networking-dhcp-dnsmasq",
-                    networks=[ContainerNetworkMeta(network_name="internal", mac_address=str(dnsmasq_mac))],
+                    networks=[ContainerNetworkMeta(network_name="internal", mac_address=str(self.dnsmasq_mac))],
                     environment={
-                        "ADDRESS4": str(ip4_net.network + 254),
-                        "ADDRESS6_1": str(dnsmasq_mac.ipv6(slaac_net.value or 0)),
-                        "ADDRESS6_2": str(dhcp6_net.network + 0xFFFF),
-                        "DHCP4": str(client_ip4),
-                        "DHCP6": str(util.generate_address(rnd, dhcp6_net)),
-                        "DNS6": str(dns_ip),
-                        "DOMAIN": random_domain,
-                        "SLAAC": str(slaac_net.network),
+                        "ADDRESS4": str(self.ip4_net.network + 254),
+                        "ADDRESS6_1": str(
+                            self.dnsmasq_mac.ipv6(self.slaac_net.value or 0)
+                        ),
+                        "ADDRESS6_2": str(self.dhcp6_net.network + 0xFFFF),
+                        "DHCP4": str(self.client_ip4),
+                        "DHCP6": str(self.dhcp6_ip),
+                        "DNS6": str(self.dns_ip),
+                        "DOMAIN": self.random_domain,
+                        "SLAAC": str(self.slaac_net.network),
                     },
                     volumes=util.socket_volume(),
                 ),
@@ -108,9 +174,9 @@ class DHCPVariant:
                     image="ct-itmo/labs-networking-dhcp-nsd",
                     networks=[ContainerNetworkMeta(network_name="internal")],
                     environment={
-                        "HOSTIP": str(dns_ip),
+                        "HOSTIP": str(self.dns_ip),
                         "DOMAIN": self.http_domain,
-                        "AAAAIP": str(http_mac.ipv6(slaac_net.value or 0)),
+                        "AAAAIP": str(self.http_mac.ipv6(self.slaac_net.value or 0)),
                     },
                     mem_limit=200 * 1024 * 1024,
                     ipv6_forwarding=False,
@@ -118,7 +184,7 @@ class DHCPVariant:
                 ContainerMeta(
                     name="ping",
                     image="ct-itmo/labs-networking-ping",
-                    networks=[ContainerNetworkMeta(network_name="internal", mac_address=str(ping_mac))],
+                    networks=[ContainerNetworkMeta(network_name="internal", mac_address=str(self.ping_mac))],
                     environment={
                         "STUDENT_IP": "any",
                         "CHAPTER": "dhcp",
@@ -130,9 +196,9 @@ class DHCPVariant:
                 ContainerMeta(
                     name="http",
                     image="ct-itmo/labs-networking-dhcp-http",
-                    networks=[ContainerNetworkMeta(network_name="internal", mac_address=str(http_mac))],
+                    networks=[ContainerNetworkMeta(network_name="internal", mac_address=str(self.http_mac))],
                     environment={
-                        "BIND": f"[{http_ip}]:9229",
+                        "BIND": f"[{self.http_ip}]:9229",
                         "HOST": f"{self.http_domain}.localnetwork:9229",
                     },
                     volumes=util.socket_volume(),
@@ -142,17 +208,6 @@ class DHCPVariant:
             networks=[NetworkMeta(name="internal")],
         )
 
-        self.form_classes = [
-            RegexpForm.make_task("net", answer=re.compile(f"^{client_ip4}/24$", re.I)),
-            RegexpForm.make_task("dns", answer=re.compile(f"^{http_ip}$", re.I)),
-            RegexpForm.make_task(
-                "domain",
-                answer=re.compile(
-                    f"^{random_domain.replace('.', chr(92) + '.')}\\.?$", re.I
-                ),
-            ),
-        ]
-
 
 class DHCPChapter(DockerMixin, FormMixin, BaseChapter[DHCPVariant]):
     slug = "dhcp"
@@ -168,10 +223,11 @@ class DHCPChapter(DockerMixin, FormMixin, BaseChapter[DHCPVariant]):
         ChapterTask("web", "Кнопка", Decimal(2)),
     ]
 
-    @util.scope_cached("variant")
-    async def get_variant(self, request: Request) -> DHCPVariant:
-        user_id: int = request.scope["user"].id
-        return DHCPVariant(user_id)
+    def generate_params(self, user_id: int) -> dict[str, Any]:
+        return DHCPVariant.generate(user_id)
+
+    def build_variant(self, user_id: int, params: Mapping[str, Any]) -> DHCPVariant:
+        return DHCPVariant(user_id, params)
 
 
 __all__ = ["DHCPChapter"]
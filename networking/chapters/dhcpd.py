@@ -1,13 +1,14 @@
+import functools
 import re
 from datetime import datetime
 from decimal import Decimal
 from random import Random
+from typing import Any, Mapping
 
 from aiodocker.containers import DockerContainer
 from aiodocker.exceptions import DockerError
-from netaddr import IPNetwork, AddrFormatError
+from netaddr import EUI, IPNetwork, AddrFormatError
 from sqlalchemy.ext.asyncio import AsyncSession
-from starlette.requests import Request
 
 from quirck.box.meta import ContainerNetworkMeta, Deployment, ContainerMeta, NetworkMeta
 from quirck.box.model import DockerMeta
@@ -16,19 +17,22 @@ from networking.core import util
 from networking.core.chapter.base import BaseChapter, ChapterTask
 from networking.core.chapter.check import Check, CheckableMixin
 from networking.core.chapter.docker import DockerMixin
-from networking.core.chapter.form import FormMixin, BaseTaskForm, RegexpForm
+from networking.core.chapter.form import FormMixin, FormTask, RegexpForm
 from networking.core.config import SECRET_SEED
 from networking.core.model import Attempt
 
 
 class DHCPDVariant:
-    deployment: Deployment
-    form_classes: list[type[BaseTaskForm]]
-    checks: dict[str, Check]
+    forms: list[FormTask]
+
+    check_names = ["dhcpd"]
 
     ip4_net: IPNetwork
     ip6_net: IPNetwork
 
+    user_id: int
+    host_mac: EUI
+
     async def check_dhcpd(
         self, session: AsyncSession, meta: DockerMeta, containers: list[DockerContainer]
     ) -> None:
@@ -50,6 +54,7 @@ class DHCPDVariant:
 
         extracted.close()
 
+        attempts = []
         for address in addresses:
             try:
                 ip = IPNetwork(address)
@@ -57,47 +62,69 @@ class DHCPDVariant:
                 continue
 
             if ip == self.ip4_net:
-                attempt = Attempt(
-                    user_id=meta.user_id,
-                    chapter=DHCPDChapter.slug,
-                    task="ip4",
-                    data={},
-                    is_correct=True,
+                attempts.append(
+                    Attempt(
+                        user_id=meta.user_id,
+                        chapter=DHCPDChapter.slug,
+                        task="ip4",
+                        data={},
+                        is_correct=True,
+                    )
                 )
-                session.add(attempt)
 
             if ip == self.ip6_net:
-                attempt = Attempt(
-                    user_id=meta.user_id,
-                    chapter=DHCPDChapter.slug,
-                    task="ip6",
-                    data={},
-                    is_correct=True,
+                attempts.append(
+                    Attempt(
+                        user_id=meta.user_id,
+                        chapter=DHCPDChapter.slug,
+                        task="ip6",
+                        data={},
+                        is_correct=True,
+                    )
                 )
-                session.add(attempt)
 
+        await DHCPDChapter.add_attempts(session, attempts)
         await session.commit()
 
-    def __init__(self, user_id: int):
+    @staticmethod
+    def generate(user_id: int) -> dict[str, Any]:
         rnd = Random(f"{SECRET_SEED}-{user_id}-dhcpd")
 
-        self.ip4_net = util.generate_subnet(rnd, IPNetwork("10.0.0.0/8"), 24)
-        self.ip6_net = util.generate_subnet(rnd, IPNetwork("fdb0::/16"), 64)
+        ip4_net = util.generate_subnet(rnd, IPNetwork("10.0.0.0/8"), 24)
+        ip6_net = util.generate_subnet(rnd, IPNetwork("fdb0::/16"), 64)
         host_mac = util.generate_mac(rnd)
 
-        self.deployment = Deployment(
-            containers=[ContainerMeta.make_vpn(user_id, ["internal"])],
-            networks=[NetworkMeta(name="internal")],
-        )
+        return {
+            "ip4_net": str(ip4_net),
+            "ip6_net": str(ip6_net),
+            "host_mac": str(host_mac),
+        }
+
+    def __init__(self, user_id: int, params: Mapping[str, Any]):
+        self.user_id = user_id
+        self.ip4_net = IPNetwork(params["ip4_net"])
+        self.ip6_net = IPNetwork(params["ip6_net"])
+        self.host_mac = EUI(params["host_mac"])
 
-        self.form_classes = [
+        self.forms = [
             RegexpForm.make_task(
                 "mac",
-                answer=re.compile(f"^{str(host_mac).replace('-', '[-:]?')}$", re.I),
+                answer=re.compile(
+                    f"^{str(self.host_mac).replace('-', '[-:]?')}$", re.I
+                ),
             )
         ]
 
-        self.checks = {
+    @functools.cached_property
+    def deployment(self) -> Deployment:
+        return Deployment(
+            containers=[ContainerMeta.make_vpn(self.user_id, ["internal"])],
+            networks=[NetworkMeta(name="internal")],
+        )
+
+    @functools.cached_property
+    def checks(self) -> dict[str, Check]:
+        return {
             "dhcpd": Check(
                 [
                     ContainerMeta(
@@ -106,7 +133,7 @@ class DHCPDVariant:
                         networks=[
                             ContainerNetworkMeta(
                                 network_name="internal",
-                                mac_address=str(host_mac),
+                                mac_address=str(self.host_mac),
                                 sysctls=["net.ipv4.conf.IFNAME.promote_secondaries=1"]
                             )
                         ],
@@ -115,6 +142,9 @@ class DHCPDVariant:
                 ],
                 {0: "/out/dhcpcd.log"},
                 self.check_dhcpd,
+                # Two 5-second dhcpcd runs and 4 seconds of pauses in the bot
+                timeout=20,
+                tasks=["ip4", "ip6"],
             )
         }
 
@@ -129,10 +159,11 @@ class DHCPDChapter(CheckableMixin, DockerMixin, FormMixin, BaseChapter[DHCPDVari
         ChapterTask("mac", "MAC-адрес", Decimal(1)),
     ]
 
-    @util.scope_cached("variant")
-    async def get_variant(self, request: Request) -> DHCPDVariant:
-        user_id: int = request.scope["user"].id
-        return DHCPDVariant(user_id)
+    def generate_params(self, user_id: int) -> dict[str, Any]:
+        return DHCPDVariant.generate(user_id)
+
+    def build_variant(self, user_id: int, params: Mapping[str, Any]) -> DHCPDVariant:
+        return DHCPDVariant(user_id, params)
 
 
 __all__ = ["DHCPDChapter"]
@@ -1,13 +1,14 @@
+import functools
 import re
 import string
 from datetime import datetime
 from decimal import Decimal
 from random import Random
+from typing import Any, Mapping
 
 from aiodocker.containers import DockerContainer
 from netaddr import IPAddress, IPNetwork
 from sqlalchemy.ext.asyncio import AsyncSession
-from starlette.requests import Request
 
 from quirck.box.meta import ContainerNetworkMeta, Deployment, ContainerMeta, NetworkMeta
 from quirck.box.model import DockerMeta
@@ -17,16 +18,21 @@ from networking.core import util
 from networking.core.chapter.base import BaseChapter, ChapterTask
 from networking.core.chapter.check import Check, CheckableMixin
 from networking.core.chapter.docker import DockerMixin
-from networking.core.chapter.form import FormMixin, BaseTaskForm, RegexpForm
+from networking.core.chapter.form import FormMixin, FormTask, RegexpForm
 from networking.core.config import SECRET_SEED
 
 DNS_REGEXP_IP = config("DNS_REGEXP_IP", cast=str)
 DNS_REGEXP_SERVERS = config("DNS_REGEXP_SERVERS", cast=str)
 
+# Same answers for all users
+DNS_ANSWER_IP = re.compile(DNS_REGEXP_IP, re.I)
+DNS_ANSWER_SERVERS = re.compile(DNS_REGEXP_SERVERS, re.I)
+
 
 class DNSVariant:
-    deployment: Deployment
-    form_classes: list[type[BaseTaskForm]]
+    forms: list[FormTask]
+
+    check_names = ["dns"]
 
     domain: str
     ip4: IPAddress
@@ -34,6 +40,8 @@ class DNSVariant:
     subdomain: str
     subip6: IPAddress
 
+    user_id: int
+
     async def check_dns(
         self,
         _session: AsyncSession,
@@ -43,21 +51,45 @@ class DNSVariant:
         # Empty, all points are passed from the bot
         ...
 
-    def __init__(self, user_id: int):
+    @staticmethod
+    def generate(user_id: int) -> dict[str, Any]:
         rnd = Random(f"{SECRET_SEED}-{user_id}-dns")
 
-        self.domain = f"{''.join(rnd.choice(string.ascii_lowercase + string.digits) for _ in range(10))}.localnetwork"
-        self.subdomain = "".join(
+        domain = f"{''.join(rnd.choice(string.ascii_lowercase + string.digits) for _ in range(10))}.localnetwork"
+        subdomain = "".join(
             rnd.choice(string.ascii_lowercase + string.digits) for _ in range(5)
         )
-        self.ip4 = util.generate_address(rnd, IPNetwork("10.52.1.128/25"))
-        self.ip6, self.subip6 = util.generate_distinct(
+        ip4 = util.generate_address(rnd, IPNetwork("10.52.1.128/25"))
+        ip6, subip6 = util.generate_distinct(
             2, util.generate_address, rnd, IPNetwork("fd44:1337::/64")
         )
 
-        self.deployment = Deployment(
+        return {
+            "domain": domain,
+            "subdomain": subdomain,
+            "ip4": str(ip4),
+            "ip6": str(ip6),
+            "subip6": str(subip6),
+        }
+
+    def __init__(self, user_id: int, params: Mapping[str, Any]):
+        self.user_id = user_id
+        self.domain = params["domain"]
+        self.subdomain = params["subdomain"]
+        self.ip4 = IPAddress(params["ip4"])
+        self.ip6 = IPAddress(params["ip6"])
+        self.subip6 = IPAddress(params["subip6"])
+
+        self.forms = [
+            RegexpForm.make_task("ip", answer=DNS_ANSWER_IP),
+            RegexpForm.make_task("servers", answer=DNS_ANSWER_SERVERS),
+        ]
+
+    @functools.cached_property
+    def deployment(self) -> Deployment:
+        return Deployment(
             containers=[
-                ContainerMeta.make_vpn(user_id, ["internal"]),
+                ContainerMeta.make_vpn(self.user_id, ["internal"]),
                 ContainerMeta(
                     name="domain",
                     image="ct-itmo/labs-networking-nginx",
@@ -83,14 +115,9 @@ class DNSVariant:
             networks=[NetworkMeta(name="internal")],
         )
 
-        self.form_classes = [
-            RegexpForm.make_task("ip", answer=re.compile(DNS_REGEXP_IP, re.I)),
-            RegexpForm.make_task(
-                "servers", answer=re.compile(DNS_REGEXP_SERVERS, re.I)
-            ),
-        ]
-
-        self.checks = {
+    @functools.cached_property
+    def checks(self) -> dict[str, Check]:
+        return {
             "dns": Check(
                 [
                     ContainerMeta(
@@ -111,6 +138,8 @@ class DNSVariant:
                 ],
                 {0: "/out/dns.log"},
                 self.check_dns,
+                # The bot reports every task through the socket
+                tasks=[task.slug for task in DNSChapter.tasks],
             )
         }
 
@@ -129,10 +158,11 @@ class DNSChapter(CheckableMixin, DockerMixin, FormMixin, BaseChapter[DNSVariant]
         ChapterTask("transfer", "Трансфер", Decimal(2)),
     ]
 
-    @util.scope_cached("variant")
-    async def get_variant(self, request: Request) -> DNSVariant:
-        user_id: int = request.scope["user"].id
-        return DNSVariant(user_id)
+    def generate_params(self, user_id: int) -> dict[str, Any]:
+        return DNSVariant.generate(user_id)
+
+    def build_variant(self, user_id: int, params: Mapping[str, Any]) -> DNSVariant:
+        return DNSVariant(user_id, params)
 
 
 __all__ = ["DNSChapter"]
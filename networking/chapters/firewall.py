@@ -1,14 +1,14 @@
+import functools
 import re
 from datetime import datetime
 from decimal import Decimal
 from random import Random
-from typing import Literal
+from typing import Any, Literal, Mapping
 
 from aiodocker.containers import DockerContainer
 from aiodocker.exceptions import DockerError
-from netaddr import IPAddress, IPNetwork
+from netaddr import EUI, IPAddress, IPNetwork
 from sqlalchemy.ext.asyncio import AsyncSession
-from starlette.requests import Request
 
 from quirck.box.meta import ContainerNetworkMeta, Deployment, ContainerMeta, NetworkMeta
 from quirck.box.model import DockerMeta
@@ -54,13 +54,23 @@ async def commit_correct_attempt(
         data={},
         is_correct=True,
     )
-    session.add(attempt)
+    await FirewallChapter.add_attempts(session, [attempt])
     await session.commit()
 
 
 class FirewallVariant:
-    deployment: Deployment
-    form_classes = []
+    # Same as the keys of checks, which are costly to build
+    check_names = [
+        "setup",
+        "forward_a_to_b",
+        "forward_b_to_a",
+        "tcp_unidirectional",
+        "udp_ports",
+        "tcp_body_filter",
+        "forward_nat",
+        "icmp_config",
+        "http_access",
+    ]
 
     ip4_a_network: IPNetwork
     ip4_b_network: IPNetwork
@@ -77,6 +87,14 @@ class FirewallVariant:
     icmp_ttl: int
     tcp_bad_word: str
 
+    user_id: int
+    udp_ports_number: list[int]
+    mac_a_client: EUI
+    mac_b_client: EUI
+    mac_a_checker: EUI
+    mac_b_checker: EUI
+    mac_b_client2: EUI
+
     async def check_tcp_unidirectional(
         self, session: AsyncSession, meta: DockerMeta, containers: list[DockerContainer]
     ) -> None:
@@ -128,103 +146,146 @@ class FirewallVariant:
         except DockerError:
             return
 
-        attempt = Attempt(
-            user_id=meta.user_id,
-            chapter=FirewallChapter.slug,
-            task="udp_ports",
-            data={},
-            is_correct=True,
-        )
-
-        session.add(attempt)
-        await session.commit()
+        await commit_correct_attempt(session, meta, "udp_ports")
 
-    def __init__(self, user_id: int):
+    @staticmethod
+    def generate(user_id: int) -> dict[str, Any]:
         rnd = Random(f"{SECRET_SEED}-{user_id}")
 
-        self.ip4_a_network = util.generate_subnet(rnd, IPNetwork("10.0.0.0/9"), 24)
-        self.ip4_b_network = util.generate_subnet(rnd, IPNetwork("10.128.0.0/9"), 24)
+        ip4_a_network = util.generate_subnet(rnd, IPNetwork("10.0.0.0/9"), 24)
+        ip4_b_network = util.generate_subnet(rnd, IPNetwork("10.128.0.0/9"), 24)
 
-        self.ip4_a_firewall = IPAddress(
-            self.ip4_a_network.first | 1, self.ip4_a_network.version
-        )
-        self.ip4_a_client, self.ip4_a_client2, self.ip4_a_free, ip4_a_checker = (
+        ip4_a_client, ip4_a_client2, ip4_a_free, ip4_a_checker = (
             util.generate_distinct(
-                4, util.generate_address, rnd, self.ip4_a_network, no_gateway=True
+                4, util.generate_address, rnd, ip4_a_network, no_gateway=True
             )
         )
-
-        self.ip4_b_firewall = IPAddress(
-            self.ip4_b_network.first | 1, self.ip4_a_network.version
-        )
-        self.ip4_b_client, self.ip4_b_free, ip4_b_checker, self.ip4_b_client2 = (
+        ip4_b_client, ip4_b_free, ip4_b_checker, ip4_b_client2 = (
             util.generate_distinct(
-                4, util.generate_address, rnd, self.ip4_b_network, no_gateway=True
+                4, util.generate_address, rnd, ip4_b_network, no_gateway=True
             )
         )
 
         udp_ports_number = util.generate_distinct(10, rnd.randint, 2001, 3000)
-        self.allow_udp_port2 = udp_ports_number[0]
-        deny_udp_addresses = addresses_list(
-            *map(lambda p: (self.ip4_b_client2, p), udp_ports_number[1:])
-        )
-        udp_ports_client_listen = addresses_list(
-            *map(lambda p: (self.ip4_b_client2, p), udp_ports_number)
-        )
 
-        self.icmp_ttl = rnd.randint(20, 50)
+        icmp_ttl = rnd.randint(20, 50)
 
         mac_a_client, mac_b_client, mac_a_checker, mac_b_checker, mac_b_client2 = (
             util.generate_distinct(5, util.generate_mac, rnd)
         )
 
-        self.tcp_bad_word = f"{rnd.choice(NOUNS)}-{rnd.randint(1, 100)}"
+        tcp_bad_word = f"{rnd.choice(NOUNS)}-{rnd.randint(1, 100)}"
+
+        return {
+            "ip4_a_network": str(ip4_a_network),
+            "ip4_b_network": str(ip4_b_network),
+            "ip4_a_client": str(ip4_a_client),
+            "ip4_a_client2": str(ip4_a_client2),
+            "ip4_a_free": str(ip4_a_free),
+            "ip4_a_checker": str(ip4_a_checker),
+            "ip4_b_client": str(ip4_b_client),
+            "ip4_b_free": str(ip4_b_free),
+            "ip4_b_checker": str(ip4_b_checker),
+            "ip4_b_client2": str(ip4_b_client2),
+            "udp_ports": list(udp_ports_number),
+            "icmp_ttl": icmp_ttl,
+            "mac_a_client": str(mac_a_client),
+            "mac_b_client": str(mac_b_client),
+            "mac_a_checker": str(mac_a_checker),
+            "mac_b_checker": str(mac_b_checker),
+            "mac_b_client2": str(mac_b_client2),
+            "tcp_bad_word": tcp_bad_word,
+        }
 
-        self.http_access_host = EXTERNAL_BASE_URL
+    def __init__(self, user_id: int, params: Mapping[str, Any]):
+        self.user_id = user_id
 
-        def make_checker_meta(
-            name: str,
-            network_type: Literal["A", "B"],
-            check_mode: str = "basic",
-            environment: dict[str, str] = {},
-            task: str | None = None,
-            add_gateway: bool = True,
-            add_socket_volume: bool = False,
-        ) -> ContainerMeta:
-            env = {
-                "BOX_IP": str(ip4_a_checker if network_type == "A" else ip4_b_checker),
-                "BOX_NETWORK_NAME": "internal" + network_type,
-                "CHECK_MODE": check_mode,
-            }
-            if task is not None:
-                env["TASK"] = task
-                env["CHAPTER"] = "firewall"
-            if add_gateway:
-                env["BOX_GATEWAY"] = str(
-                    self.ip4_a_firewall if network_type == "A" else self.ip4_b_firewall
-                )
+        self.ip4_a_network = IPNetwork(params["ip4_a_network"])
+        self.ip4_b_network = IPNetwork(params["ip4_b_network"])
 
-            return ContainerMeta(
-                name="check-" + name,
-                image="ct-itmo/labs-networking-firewall-checker",
-                networks=[
-                    ContainerNetworkMeta(
-                        network_name="internal" + network_type,
-                        mac_address=str(mac_a_checker if network_type == "A" else mac_b_checker)
-                    )
-                ],
-                ipv6_forwarding=False,
-                environment={**env, **environment},
-                volumes=util.socket_volume() if add_socket_volume else {},
+        self.ip4_a_firewall = IPAddress(
+            self.ip4_a_network.first | 1, self.ip4_a_network.version
+        )
+        self.ip4_a_client = IPAddress(params["ip4_a_client"])
+        self.ip4_a_client2 = IPAddress(params["ip4_a_client2"])
+        self.ip4_a_free = IPAddress(params["ip4_a_free"])
+        self.ip4_a_checker = IPAddress(params["ip4_a_checker"])
+
+        self.ip4_b_firewall = IPAddress(
+            self.ip4_b_network.first | 1, self.ip4_a_network.version
+        )
+        self.ip4_b_client = IPAddress(params["ip4_b_client"])
+        self.ip4_b_free = IPAddress(params["ip4_b_free"])
+        self.ip4_b_checker = IPAddress(params["ip4_b_checker"])
+        self.ip4_b_client2 = IPAddress(params["ip4_b_client2"])
+
+        self.udp_ports_number = params["udp_ports"]
+        self.allow_udp_port2 = self.udp_ports_number[0]
+
+        self.icmp_ttl = params["icmp_ttl"]
+
+        self.mac_a_client = EUI(params["mac_a_client"])
+        self.mac_b_client = EUI(params["mac_b_client"])
+        self.mac_a_checker = EUI(params["mac_a_checker"])
+        self.mac_b_checker = EUI(params["mac_b_checker"])
+        self.mac_b_client2 = EUI(params["mac_b_client2"])
+
+        self.tcp_bad_word = params["tcp_bad_word"]
+
+        self.http_access_host = EXTERNAL_BASE_URL
+
+    def make_checker_meta(
+        self,
+        name: str,
+        network_type: Literal["A", "B"],
+        check_mode: str = "basic",
+        environment: dict[str, str] = {},
+        task: str | None = None,
+        add_gateway: bool = True,
+        add_socket_volume: bool = False,
+    ) -> ContainerMeta:
+        env = {
+            "BOX_IP": str(
+                self.ip4_a_checker if network_type == "A" else self.ip4_b_checker
+            ),
+            "BOX_NETWORK_NAME": "internal" + network_type,
+            "CHECK_MODE": check_mode,
+        }
+        if task is not None:
+            env["TASK"] = task
+            env["CHAPTER"] = "firewall"
+        if add_gateway:
+            env["BOX_GATEWAY"] = str(
+                self.ip4_a_firewall if network_type == "A" else self.ip4_b_firewall
             )
 
-        self.deployment = Deployment(
+        return ContainerMeta(
+            name="check-" + name,
+            image="ct-itmo/labs-networking-firewall-checker",
+            networks=[
+                ContainerNetworkMeta(
+                    network_name="internal" + network_type,
+                    mac_address=str(
+                        self.mac_a_checker
+                        if network_type == "A"
+                        else self.mac_b_checker
+                    ),
+                )
+            ],
+            ipv6_forwarding=False,
+            environment={**env, **environment},
+            volumes=util.socket_volume() if add_socket_volume else {},
+        )
+
+    @functools.cached_property
+    def deployment(self) -> Deployment:
+        return Deployment(
             containers=[
-                ContainerMeta.make_vpn(user_id, ["internalA", "internalB"]),
+                ContainerMeta.make_vpn(self.user_id, ["internalA", "internalB"]),
                 ContainerMeta(
                     name="client-a",
                     image="ct-itmo/labs-networking-firewall-client",
-                    networks=[ContainerNetworkMeta(network_name="internalA", mac_address=str(mac_a_client))],
+                    networks=[ContainerNetworkMeta(network_name="internalA", mac_address=str(self.mac_a_client))],
                     environment={
                         "BOX_IP": str(self.ip4_a_client),
                         "BOX_IP2": str(self.ip4_a_client2),
@@ -239,7 +300,7 @@ class FirewallVariant:
                 ContainerMeta(
                     name="client-b",
                     image="ct-itmo/labs-networking-firewall-client",
-                    networks=[ContainerNetworkMeta(network_name="internalB", mac_address=str(mac_b_client))],
+                    networks=[ContainerNetworkMeta(network_name="internalB", mac_address=str(self.mac_b_client))],
                     environment={
                         "BOX_IP": str(self.ip4_b_client),
                         "BOX_GATEWAY": str(self.ip4_b_firewall),
@@ -256,15 +317,24 @@ class FirewallVariant:
             ],
         )
 
-        self.checks = {
+    @functools.cached_property
+    def checks(self) -> dict[str, Check]:
+        deny_udp_addresses = addresses_list(
+            *map(lambda p: (self.ip4_b_client2, p), self.udp_ports_number[1:])
+        )
+        udp_ports_client_listen = addresses_list(
+            *map(lambda p: (self.ip4_b_client2, p), self.udp_ports_number)
+        )
+
+        return {
             "setup": Check(
                 [
-                    make_checker_meta(
+                    self.make_checker_meta(
                         name="ping",
                         network_type="B",
                         task="setup",
                         environment={
-                            "BOX_IP2": str(ip4_a_checker),
+                            "BOX_IP2": str(self.ip4_a_checker),
                             "PING_VALID_IPS": str(self.ip4_b_firewall)
                             + ","
                             + str(self.ip4_b_client),
@@ -280,7 +350,7 @@ class FirewallVariant:
             ),
             "forward_a_to_b": Check(
                 [
-                    make_checker_meta(
+                    self.make_checker_meta(
                         name="forward-a-to-b",
                         network_type="A",
                         task="forward_a_to_b",
@@ -302,7 +372,7 @@ class FirewallVariant:
             ),
             "forward_b_to_a": Check(
                 [
-                    make_checker_meta(
+                    self.make_checker_meta(
                         name="forward-b-to-a",
                         network_type="B",
                         task="forward_b_to_a",
@@ -321,7 +391,7 @@ class FirewallVariant:
             ),
             "tcp_unidirectional": Check(
                 [
-                    make_checker_meta(
+                    self.make_checker_meta(
                         name="tcp-unidirectional-a",
                         network_type="A",
                         environment={
@@ -337,7 +407,7 @@ class FirewallVariant:
                         },
                         add_socket_volume=True,
                     ),
-                    make_checker_meta(
+                    self.make_checker_meta(
                         name="tcp-unidirectional-b",
                         network_type="B",
                         environment={
@@ -362,7 +432,7 @@ class FirewallVariant:
             ),
             "udp_ports": Check(
                 [
-                    make_checker_meta(
+                    self.make_checker_meta(
                         name="udp-ports-a",
                         network_type="A",
                         environment={
@@ -376,7 +446,7 @@ class FirewallVariant:
                             "STARTUP_TIMEOUT": "2",
                         },
                     ),
-                    make_checker_meta(
+                    self.make_checker_meta(
                         name="udp-ports-b",
                         network_type="B",
                         environment={
@@ -388,7 +458,7 @@ class FirewallVariant:
                     ContainerMeta(
                         name="check-udp-ports-b-client",
                         image="ct-itmo/labs-networking-firewall-client",
-                        networks=[ContainerNetworkMeta(network_name="internalB", mac_address=str(mac_b_client2))],
+                        networks=[ContainerNetworkMeta(network_name="internalB", mac_address=str(self.mac_b_client2))],
                         ipv6_forwarding=False,
                         environment={
                             "BOX_IP": str(self.ip4_b_client2),
@@ -409,10 +479,14 @@ class FirewallVariant:
                     f"=== from network A:\n{container_logs[0]}\n"
                     f"=== logs from servers in network B:\n{container_logs[2]}"
                 ),
+                # The server container always runs for its TIMEOUT. Its log is
+                # read once the checkers have sent everything and it logged that.
+                wait_for=[0, 1],
+                drain=1,
             ),
             "tcp_body_filter": Check(
                 [
-                    make_checker_meta(
+                    self.make_checker_meta(
                         name="tcp-body-filter-a",
                         network_type="A",
                         check_mode="tcp_body_filter",
@@ -430,7 +504,7 @@ class FirewallVariant:
             ),
             "forward_nat": Check(
                 [
-                    make_checker_meta(
+                    self.make_checker_meta(
                         name="forward-a-to-b",
                         network_type="A",
                         check_mode="forwarding_nat",
@@ -444,7 +518,7 @@ class FirewallVariant:
                             ),
                         },
                     ),
-                    make_checker_meta(
+                    self.make_checker_meta(
                         name="forward-b-to-a",
                         network_type="B",
                         check_mode="forwarding_nat",
@@ -461,7 +535,7 @@ class FirewallVariant:
             ),
             "icmp_config": Check(
                 [
-                    make_checker_meta(
+                    self.make_checker_meta(
                         name="icmp-config-b",
                         network_type="B",
                         check_mode="icmp_config",
@@ -474,10 +548,12 @@ class FirewallVariant:
                     )
                 ],
                 {0: "/out/check.log"},
+                # The checker pings for at most 15 seconds
+                timeout=20,
             ),
             "http_access": Check(
                 [
-                    make_checker_meta(
+                    self.make_checker_meta(
                         name="icmp-http-access",
                         network_type="A",
                         check_mode="http_access",
@@ -513,10 +589,11 @@ class FirewallChapter(CheckableMixin, DockerMixin, BaseChapter[FirewallVariant])
         ChapterTask("http_access", "HTTP-доступ", Decimal(1)),
     ]
 
-    @util.scope_cached("variant")
-    async def get_variant(self, request: Request) -> FirewallVariant:
-        user_id: int = request.scope["user"].id
-        return FirewallVariant(user_id)
+    def generate_params(self, user_id: int) -> dict[str, Any]:
+        return FirewallVariant.generate(user_id)
+
+    def build_variant(self, user_id: int, params: Mapping[str, Any]) -> FirewallVariant:
+        return FirewallVariant(user_id, params)
 
 
 __all__ = ["FirewallChapter"]
@@ -1,10 +1,11 @@
+import functools
 import re
 from datetime import datetime
 from decimal import Decimal
 from random import Random
+from typing import Any, Mapping
 
 from netaddr import EUI, IPAddress, IPNetwork
-from starlette.requests import Request
 from wtforms.fields import BooleanField
 
 from quirck.box.meta import ContainerNetworkMeta, Deployment, ContainerMeta, NetworkMeta
@@ -14,7 +15,7 @@ from networking.core.chapter.base import BaseChapter, ChapterTask
 from networking.core.chapter.docker import DockerMixin
 from networking.core.chapter.form import (
     FormMixin,
-    BaseTaskForm,
+    FormTask,
     RegexpForm,
     SingleTaskForm,
 )
@@ -30,8 +31,7 @@ class NetcalcForm(SingleTaskForm):
 
 
 class IPVariant:
-    deployment: Deployment
-    form_classes: list[type[BaseTaskForm]]
+    forms: list[FormTask]
 
     ll_mac: EUI
     ip4_client: IPAddress
@@ -39,18 +39,24 @@ class IPVariant:
     ip6_client: IPAddress
     ip6_server: IPAddress
 
-    def __init__(self, user_id: int):
+    user_id: int
+    mtu: int
+    mac4: EUI
+    mac6: EUI
+
+    @staticmethod
+    def generate(user_id: int) -> dict[str, Any]:
         rnd = Random(f"{SECRET_SEED}-{user_id}")
 
-        self.ll_mac = util.generate_mac(rnd)
+        ll_mac = util.generate_mac(rnd)
 
         ip4_network = util.generate_subnet(rnd, IPNetwork("10.0.0.0/8"), 24)
-        self.ip4_client, self.ip4_server = util.generate_distinct(
+        ip4_client, ip4_server = util.generate_distinct(
             2, util.generate_address, rnd, ip4_network
         )
 
         ip6_network = util.generate_subnet(rnd, IPNetwork("fd33::/16"), 64)
-        self.ip6_client, self.ip6_server = util.generate_distinct(
+        ip6_client, ip6_server = util.generate_distinct(
             2, util.generate_address, rnd, ip6_network
         )
 
@@ -59,13 +65,51 @@ class IPVariant:
         mac4 = util.generate_mac(rnd)
         mac6 = util.generate_mac(rnd)
 
-        self.deployment = Deployment(
+        return {
+            "ll_mac": str(ll_mac),
+            "ip4_client": str(ip4_client),
+            "ip4_server": str(ip4_server),
+            "ip6_client": str(ip6_client),
+            "ip6_server": str(ip6_server),
+            "mtu": mtu,
+            "mac4": str(mac4),
+            "mac6": str(mac6),
+        }
+
+    def __init__(self, user_id: int, params: Mapping[str, Any]):
+        self.ll_mac = EUI(params["ll_mac"])
+        self.ip4_client = IPAddress(params["ip4_client"])
+        self.ip4_server = IPAddress(params["ip4_server"])
+        self.ip6_client = IPAddress(params["ip6_client"])
+        self.ip6_server = IPAddress(params["ip6_server"])
+
+        self.user_id = user_id
+        self.mtu = params["mtu"]
+        self.mac4 = EUI(params["mac4"])
+        self.mac6 = EUI(params["mac6"])
+
+        self.forms = [
+            NetcalcForm.make_task("netcalc"),
+            RegexpForm.make_task(
+                "mac4",
+                answer=re.compile(f"^{str(self.mac4).replace('-', '[-:]?')}$", re.I),
+            ),
+            RegexpForm.make_task(
+                "mac6",
+                answer=re.compile(f"^{str(self.mac6).replace('-', '[-:]?')}$", re.I),
+            ),
+            RegexpForm.make_task("mtu", answer=re.compile(f"^{self.mtu}$", re.I)),
+        ]
+
+    @functools.cached_property
+    def deployment(self) -> Deployment:
+        return Deployment(
             containers=[
-                ContainerMeta.make_vpn(user_id, ["internal"]),
+                ContainerMeta.make_vpn(self.user_id, ["internal"]),
                 ContainerMeta(
                     name="ping4",
                     image="ct-itmo/labs-networking-ping",
-                    networks=[ContainerNetworkMeta(network_name="internal", mac_address=str(mac4))],
+                    networks=[ContainerNetworkMeta(network_name="internal", mac_address=str(self.mac4))],
                     environment={
                         "BOX_IP": str(self.ip4_server),
                         "STUDENT_IP": str(self.ip4_client),
@@ -88,11 +132,11 @@ class IPVariant:
                 ContainerMeta(
                     name="ping6",
                     image="ct-itmo/labs-networking-ping",
-                    networks=[ContainerNetworkMeta(network_name="internal", mac_address=str(mac6))],
+                    networks=[ContainerNetworkMeta(network_name="internal", mac_address=str(self.mac6))],
                     environment={
                         "BOX_IP": str(self.ip6_server),
                         "STUDENT_IP": str(self.ip6_client),
-                        "MTU": str(mtu),
+                        "MTU": str(self.mtu),
                         "CHAPTER": "ip",
                         "TASK": "ping6",
                     },
@@ -102,17 +146,6 @@ class IPVariant:
             networks=[NetworkMeta(name="internal")],
         )
 
-        self.form_classes = [
-            NetcalcForm.make_task("netcalc"),
-            RegexpForm.make_task(
-                "mac4", answer=re.compile(f"^{str(mac4).replace('-', '[-:]?')}$", re.I)
-            ),
-            RegexpForm.make_task(
-                "mac6", answer=re.compile(f"^{str(mac6).replace('-', '[-:]?')}$", re.I)
-            ),
-            RegexpForm.make_task("mtu", answer=re.compile(f"^{mtu}$", re.I)),
-        ]
-
 
 class IPChapter(DockerMixin, FormMixin, BaseChapter[IPVariant]):
     slug = "ip"
@@ -128,10 +161,11 @@ class IPChapter(DockerMixin, FormMixin, BaseChapter[IPVariant]):
         ChapterTask("mtu", "MTU", Decimal(2)),
     ]
 
-    @util.scope_cached("variant")
-    async def get_variant(self, request: Request) -> IPVariant:
-        user_id: int = request.scope["user"].id
-        return IPVariant(user_id)
+    def generate_params(self, user_id: int) -> dict[str, Any]:
+        return IPVariant.generate(user_id)
+
+    def build_variant(self, user_id: int, params: Mapping[str, Any]) -> IPVariant:
+        return IPVariant(user_id, params)
 
 
 __all__ = ["IPChapter"]
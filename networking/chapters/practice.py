@@ -1,9 +1,7 @@
 from datetime import datetime
 from decimal import Decimal
+from typing import Any, Mapping
 
-from starlette.requests import Request
-
-from networking.core import util
 from networking.core.chapter.base import BaseChapter, ChapterTask
 
 
@@ -17,8 +15,9 @@ class PracticeChapter(BaseChapter[PracticeVariant]):
     tasks = [ChapterTask("practice", "Практическое задание", Decimal(10))]
     need_report = False
 
-    @util.scope_cached("variant")
-    async def get_variant(self, request: Request) -> PracticeVariant:
+    def build_variant(
+        self, user_id: int, params: Mapping[str, Any]
+    ) -> PracticeVariant:
         return PracticeVariant()
 
 
@@ -0,0 +1,134 @@
+import asyncio
+import codecs
+import contextlib
+import tarfile
+from collections import deque
+from typing import AsyncIterator
+
+from aiodocker.containers import DockerContainer
+from aiodocker.exceptions import DockerError
+from aiohttp import StreamReader
+
+CHUNK_SIZE = 64 * 1024
+
+
+class BoundedText:
+    # Keeps the beginning and the end of a byte stream within `limit` bytes
+
+    def __init__(self, limit: int):
+        self.head_limit = limit // 2
+        self.tail_limit = limit - self.head_limit
+
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.head: list[str] = []
+        self.head_size = 0
+
+        self.tail: deque[bytes] = deque()
+        self.tail_size = 0
+        self.skipped = 0
+
+    def write(self, data: bytes) -> None:
+        if self.head_size < self.head_limit:
+            part = data[: self.head_limit - self.head_size]
+            self.head.append(self.decoder.decode(part))
+            self.head_size += len(part)
+            data = data[len(part) :]
+
+        if not data:
+            return
+
+        self.tail.append(data)
+        self.tail_size += len(data)
+
+        # Whole chunks are dropped while the rest still fills the tail
+        while self.tail and self.tail_size - len(self.tail[0]) >= self.tail_limit:
+            dropped = self.tail.popleft()
+            self.tail_size -= len(dropped)
+            self.skipped += len(dropped)
+
+    def getvalue(self) -> str:
+        tail = b"".join(self.tail)
+        skipped = self.skipped + max(len(tail) - self.tail_limit, 0)
+        tail = tail[len(tail) - self.tail_limit :] if skipped else tail
+
+        if not skipped:
+            return "".join(self.head) + self.decoder.decode(tail, final=True)
+
+        # Do not start the tail in the middle of a character
+        start = 0
+        while start < min(len(tail), 3) and 0x80 <= tail[start] < 0xC0:
+            start += 1
+
+        return (
+            "".join(self.head)
+            + self.decoder.decode(b"", final=True)
+            + f"\n\n[... {skipped + start} bytes skipped ...]\n\n"
+            + tail[start:].decode(errors="replace")
+        )
+
+
+async def iter_tar(
+    stream: StreamReader,
+) -> AsyncIterator[tuple[tarfile.TarInfo, bytes]]:
+    # Yields chunks of regular files without buffering the archive
+    while True:
+        try:
+            header = await stream.readexactly(tarfile.BLOCKSIZE)
+        except asyncio.IncompleteReadError:
+            return
+
+        if header == bytes(tarfile.BLOCKSIZE):
+            return
+
+        info = tarfile.TarInfo.frombuf(header, "utf-8", "surrogateescape")
+
+        remaining = info.size
+        while remaining > 0:
+            chunk = await stream.read(min(remaining, CHUNK_SIZE))
+            if not chunk:
+                return
+
+            remaining -= len(chunk)
+            if info.isreg():
+                yield info, chunk
+
+        padding = -info.size % tarfile.BLOCKSIZE
+        if padding:
+            await stream.readexactly(padding)
+
+
+@contextlib.asynccontextmanager
+async def open_archive(
+    container: DockerContainer, path: str
+) -> AsyncIterator[StreamReader]:
+    # Streaming counterpart of DockerContainer.get_archive(), which reads the
+    # whole archive into memory. aiodocker has no public call for that, this is
+    # the only place using its private request helper.
+    async with container.docker._query(
+        f"containers/{container.id}/archive",
+        method="GET",
+        params={"path": path},
+    ) as response:
+        yield response.content
+
+
+async def read_log_archive(container: DockerContainer, path: str, limit: int) -> str:
+    log = BoundedText(limit)
+    current: tarfile.TarInfo | None = None
+
+    try:
+        async with open_archive(container, path) as stream:
+            async for info, chunk in iter_tar(stream):
+                if info is not current:
+                    if current is not None:
+                        log.write(b"\n\n")
+                    current = info
+
+                log.write(chunk)
+    except (DockerError, tarfile.HeaderError, asyncio.IncompleteReadError):
+        log.write(f"\n\nFile {path} cannot be read".encode())
+
+    return log.getvalue().strip()
+
+
+__all__ = ["BoundedText", "read_log_archive"]
@@ -1,10 +1,15 @@
-import itertools
+import functools
+import inspect
 from dataclasses import dataclass
 from datetime import datetime
 from decimal import Decimal
-from typing import Any, Generic, Sequence, TypeVar
+from hashlib import sha256
+from typing import Any, Generic, Iterable, Mapping, Sequence, TypeVar
 
-from sqlalchemy import select, update
+import numpy as np
+import numpy.typing as npt
+from sqlalchemy import ColumnElement, case, delete, func, null, or_, select, update
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.sql.expression import true
 from starlette.exceptions import HTTPException
@@ -13,11 +18,15 @@ from starlette.responses import RedirectResponse, Response
 from starlette.routing import Mount, BaseRoute, Route
 
 from quirck.auth.model import User
+from quirck.box.model import DockerMeta
 from quirck.web.template import TemplateResponse
 
+from networking.core import util
 from networking.core.form import ClearProgressForm, ReportForm
-from networking.core.model import Attempt, Report
-from networking.core.util import scope_cached
+from networking.core.model import Attempt, Job, Report, TaskScore, VariantSnapshot
+from networking.core.score import bump_score_version, task_score_query
+from networking.core.timing import Timings
+from networking.core.util import freeze, scope_cached, seed_fingerprint, variant_cache
 
 Variant = TypeVar("Variant")
 
@@ -61,6 +70,80 @@ class ChapterResult:
         self.score = sum((result.score or Decimal(0) for result in results), Decimal(0))
 
 
+# Batch scores are integers in 1/800 of a point: points have two decimal places,
+# late attempts are multiplied by 3/4 and debtors' scores by 3/2
+BATCH_SCALE = 100 * 4 * 2
+
+
+def to_hundredths(points: Decimal) -> int:
+    # Exact, truncated points would make batch scores differ from Decimal ones
+    hundredths = points * 100
+    if hundredths != hundredths.to_integral_value():
+        raise ValueError(f"Points {points} have more than two decimal places")
+
+    return int(hundredths)
+
+
+@dataclass
+class AttemptColumns:
+    user: npt.NDArray[np.intp]
+    task: npt.NDArray[np.intp]
+    submitted: npt.NDArray[np.datetime64]
+    # In hundredths of a point, meaningful only where has_points is set
+    points: npt.NDArray[np.int64]
+    has_points: npt.NDArray[np.bool_]
+    is_correct: npt.NDArray[np.bool_]
+
+    @classmethod
+    def from_attempts(
+        cls,
+        chapter: "type[BaseChapter] | BaseChapter",
+        attempts: Iterable[Attempt],
+        users: Mapping[int, int],
+    ) -> "AttemptColumns":
+        # `users` maps user id to its row in the result, unknown users are skipped
+        tasks = {task.slug: index for index, task in enumerate(chapter.tasks)}
+        rows = [
+            (
+                users[attempt.user_id],
+                tasks[attempt.task],
+                attempt.submitted,
+                0 if attempt.points is None else to_hundredths(attempt.points),
+                attempt.points is not None,
+                attempt.is_correct,
+            )
+            for attempt in attempts
+            if attempt.chapter == chapter.slug
+            and attempt.user_id in users
+            and attempt.task in tasks
+        ]
+        user, task, submitted, points, has_points, is_correct = (
+            zip(*rows) if rows else ((),) * 6
+        )
+
+        return cls(
+            user=np.array(user, dtype=np.intp),
+            task=np.array(task, dtype=np.intp),
+            submitted=np.array(submitted, dtype="datetime64[us]"),
+            points=np.array(points, dtype=np.int64),
+            has_points=np.array(has_points, dtype=np.bool_),
+            is_correct=np.array(is_correct, dtype=np.bool_),
+        )
+
+
+def index_attempts(
+    attempts: Iterable[Attempt],
+) -> dict[str, dict[str, list[Attempt]]]:
+    # Single pass, keeps the order of the query (usually newest attempts first)
+    index: dict[str, dict[str, list[Attempt]]] = {}
+    for attempt in attempts:
+        index.setdefault(attempt.chapter, {}).setdefault(attempt.task, []).append(
+            attempt
+        )
+
+    return index
+
+
 class BaseChapter(Generic[Variant]):
     slug: str
     name: str
@@ -72,18 +155,74 @@ class BaseChapter(Generic[Variant]):
     tasks: list[ChapterTask]
 
     routes: list[BaseRoute]
+    # Long-lived responses, served outside of the chapter mount and its middleware
+    stream_routes: list[Route]
 
     def __init__(self):
         self.routes = [
             Route("/", self.chapter_page, name="page", methods=["GET", "POST"]),
             Route("/clear", self.clear_progress, name="clear", methods=["POST"]),
         ]
+        self.stream_routes = []
 
     def get_mount(self):
         return Mount(path=f"/{self.slug}", routes=self.routes, name=self.slug)
 
+    @classmethod
+    def get_task(cls, slug: str) -> ChapterTask | None:
+        return next((task for task in cls.tasks if task.slug == slug), None)
+
+    @classmethod
+    def calculate_attempt_score(
+        cls, task: ChapterTask, attempt: Attempt
+    ) -> Decimal | None:
+        attempt_score: Decimal | None = None
+        if attempt.points is not None:
+            attempt_score = attempt.points
+        elif attempt.is_correct:
+            attempt_score = task.points
+
+        if attempt_score is None:
+            return None
+
+        if cls.deadline is not None and attempt.submitted > cls.deadline:
+            if cls.hard_deadline:
+                return None
+
+            attempt_score *= Decimal("0.75")
+
+        return attempt_score
+
+    @classmethod
+    def attempt_score_clause(cls) -> ColumnElement[Decimal | None]:
+        # Must be kept in sync with calculate_attempt_score
+        if not cls.tasks:
+            # case() needs a branch, and attempts of unknown tasks have no score
+            return null()
+
+        attempt_score = case(
+            (Attempt.points.is_not(None), Attempt.points),
+            (
+                Attempt.is_correct,
+                case(*((Attempt.task == task.slug, task.points) for task in cls.tasks)),
+            ),
+            else_=null(),
+        )
+
+        if cls.deadline is None:
+            return attempt_score
+
+        if cls.hard_deadline:
+            return case((Attempt.submitted > cls.deadline, null()), else_=attempt_score)
+
+        return case(
+            (Attempt.submitted > cls.deadline, attempt_score * Decimal("0.75")),
+            else_=attempt_score,
+        )
+
+    @classmethod
     def calculate_task_score(
-        self, task: ChapterTask, attempts: list[Attempt], with_debt: bool
+        cls, task: ChapterTask, attempts: Sequence[Attempt], with_debt: bool
     ) -> ChapterTaskResult:
         is_solved = False
         score: Decimal | None = None
@@ -92,19 +231,9 @@ class BaseChapter(Generic[Variant]):
             if attempt.is_correct:
                 is_solved = True
 
-            attempt_score: Decimal | None = None
-            if attempt.points is not None:
-                attempt_score = attempt.points
-            elif attempt.is_correct:
-                attempt_score = task.points
+            attempt_score = cls.calculate_attempt_score(task, attempt)
 
             if attempt_score is not None:
-                if self.deadline is not None and attempt.submitted > self.deadline:
-                    if self.hard_deadline:
-                        continue
-
-                    attempt_score *= Decimal("0.75")
-
                 if score is None:
                     score = attempt_score
                 else:
@@ -116,45 +245,212 @@ class BaseChapter(Generic[Variant]):
         return ChapterTaskResult(task, is_solved, score)
 
     def calculate_score(
-        self, attempts: Sequence[Attempt], with_debt: bool = False
+        self, attempts: Mapping[str, Sequence[Attempt]], with_debt: bool = False
     ) -> ChapterResult:
-        chapter_attempts = sorted(
-            (attempt for attempt in attempts if attempt.chapter == self.slug),
-            key=lambda attempt: attempt.task,
-        )
-        grouped_attempts = {
-            key: list(value)
-            for key, value in itertools.groupby(
-                chapter_attempts, key=lambda attempt: attempt.task
-            )
-        }
-
         scores = [
-            self.calculate_task_score(
-                task, grouped_attempts.get(task.slug, []), with_debt
-            )
+            self.calculate_task_score(task, attempts.get(task.slug, []), with_debt)
             for task in self.tasks
         ]
 
         return ChapterResult(self, scores)
 
-    async def get_variant(self, request: Request) -> Variant:
+    def calculate_batch_score(
+        self, columns: AttemptColumns, with_debt: npt.NDArray[np.bool_]
+    ) -> list[ChapterResult]:
+        # Same as calculate_score for every user at once, `with_debt` has a value
+        # for every user row. Points must have at most two decimal places.
+        user_count, task_count = len(with_debt), len(self.tasks)
+
+        task_points = np.array(
+            [to_hundredths(task.points) for task in self.tasks], dtype=np.int64
+        )
+
+        attempt_score = np.where(
+            columns.has_points, columns.points, task_points[columns.task]
+        ) * (BATCH_SCALE // 100)
+        has_score = columns.has_points | columns.is_correct
+
+        if self.deadline is not None:
+            is_late = columns.submitted > np.datetime64(self.deadline, "us")
+            if self.hard_deadline:
+                has_score &= ~is_late
+            else:
+                attempt_score = np.where(is_late, attempt_score * 3 // 4, attempt_score)
+
+        # -1 marks tasks without score
+        score = np.full((user_count, task_count), -1, dtype=np.int64)
+        np.maximum.at(
+            score,
+            (columns.user[has_score], columns.task[has_score]),
+            attempt_score[has_score],
+        )
+
+        is_solved = np.zeros((user_count, task_count), dtype=np.bool_)
+        np.logical_or.at(is_solved, (columns.user, columns.task), columns.is_correct)
+
+        score = np.where(
+            with_debt[:, np.newaxis] & (score >= 0), score * 3 // 2, score
+        )
+
+        return [
+            ChapterResult(
+                self,
+                [
+                    ChapterTaskResult(
+                        task,
+                        bool(is_solved[user, index]),
+                        (
+                            None
+                            if score[user, index] < 0
+                            else Decimal(int(score[user, index])) / BATCH_SCALE
+                        ),
+                    )
+                    for index, task in enumerate(self.tasks)
+                ],
+            )
+            for user in range(user_count)
+        ]
+
+    def calculate_stored_score(
+        self, scores: Mapping[str, TaskScore], with_debt: bool = False
+    ) -> ChapterResult:
+        results = []
+
+        for task in self.tasks:
+            task_score = scores.get(task.slug)
+            if task_score is None:
+                results.append(ChapterTaskResult(task))
+                continue
+
+            score = task_score.score
+            if with_debt and score is not None:
+                score *= Decimal("1.5")
+
+            results.append(ChapterTaskResult(task, task_score.is_solved, score))
+
+        return ChapterResult(self, results)
+
+    @classmethod
+    async def add_attempts(
+        cls, session: AsyncSession, attempts: Sequence[Attempt]
+    ) -> None:
+        session.add_all(attempts)
+        await session.flush()
+
+        for attempt in attempts:
+            task = cls.get_task(attempt.task)
+            if task is None:
+                continue
+
+            statement = insert(TaskScore).values(
+                user_id=attempt.user_id,
+                chapter=cls.slug,
+                task=task.slug,
+                is_solved=attempt.is_correct,
+                score=cls.calculate_attempt_score(task, attempt),
+            )
+            # greatest() ignores NULLs, so attempts without score never lower it
+            await session.execute(
+                statement.on_conflict_do_update(
+                    index_elements=[
+                        TaskScore.user_id,
+                        TaskScore.chapter,
+                        TaskScore.task,
+                    ],
+                    set_={
+                        "is_solved": or_(
+                            TaskScore.is_solved, statement.excluded.is_solved
+                        ),
+                        "score": func.greatest(
+                            TaskScore.score, statement.excluded.score
+                        ),
+                    },
+                )
+            )
+
+        if attempts:
+            await bump_score_version(session)
+
+    @classmethod
+    async def rebuild_scores(
+        cls, session: AsyncSession, user_id: int | None = None
+    ) -> None:
+        # Used after invalidation and when deadlines change
+        delete_query = delete(TaskScore).where(TaskScore.chapter == cls.slug)
+        if user_id is not None:
+            delete_query = delete_query.where(TaskScore.user_id == user_id)
+
+        await session.execute(delete_query)
+        await session.execute(
+            insert(TaskScore).from_select(
+                ["user_id", "chapter", "task", "is_solved", "score"],
+                task_score_query([cls], user_id),
+            )
+        )
+        await bump_score_version(session)
+
+    def generate_params(self, user_id: int) -> dict[str, Any]:
+        # Everything drawn from the user's random generator, as JSON values
+        return {}
+
+    def build_variant(self, user_id: int, params: Mapping[str, Any]) -> Variant:
         raise NotImplementedError()
 
+    def make_variant(self, user_id: int) -> Variant:
+        return self.build_variant(user_id, self.generate_params(user_id))
+
+    @functools.cached_property
+    def variant_version(self) -> str:
+        # Snapshots are made stale by a new seed or any change of the chapter
+        # module and the generators it uses
+        digest = sha256(seed_fingerprint().encode("utf-8"))
+        for module in (inspect.getmodule(type(self)), util):
+            digest.update(inspect.getsource(module).encode("utf-8"))
+
+        return digest.hexdigest()
+
+    async def load_variant(self, session: AsyncSession, user_id: int) -> Variant:
+        # Variants are shared between requests. They are built from frozen
+        # parameters and never modified afterwards.
+        key = (self.slug, user_id, self.variant_version)
+        variant = variant_cache.get(key)
+        if variant is None:
+            params = await session.scalar(
+                select(VariantSnapshot.params)
+                .where(VariantSnapshot.user_id == user_id)
+                .where(VariantSnapshot.chapter == self.slug)
+                .where(VariantSnapshot.version == self.variant_version)
+            )
+            if params is None:
+                params = self.generate_params(user_id)
+
+            variant = self.build_variant(user_id, freeze(params))
+            variant_cache.put(key, variant)
+
+        return variant
+
+    @scope_cached("variant")
+    async def get_variant(self, request: Request) -> Variant:
+        user: User = request.scope["user"]
+        return await self.load_variant(request.scope["db"], user.id)
+
+    async def run_job(
+        self, session: AsyncSession, meta: DockerMeta, job: Job, timings: Timings
+    ) -> None:
+        raise ValueError(f"Chapter {self.slug} cannot run {job.kind.value} jobs")
+
     @scope_cached("attempts")
-    async def get_attempts(self, request: Request) -> Sequence[Attempt]:
+    async def get_attempts(self, request: Request) -> dict[str, list[Attempt]]:
         user: User = request.scope["user"]
         session: AsyncSession = request.scope["db"]
-        attempts = (
-            await session.scalars(
-                select(Attempt)
-                .where(Attempt.user_id == user.id)
-                .where(Attempt.chapter == self.slug)
-                .order_by(Attempt.task, Attempt.submitted.desc())
-            )
-        ).all()
+        attempts = await session.scalars(
+            select(Attempt)
+            .where(Attempt.user_id == user.id)
+            .where(Attempt.chapter == self.slug)
+            .order_by(Attempt.task, Attempt.submitted.desc())
+        )
 
-        return attempts
+        return index_attempts(attempts).get(self.slug, {})
 
     async def chapter_page(
         self, request: Request, context: dict[str, Any] = {}
@@ -228,10 +524,16 @@ class BaseChapter(Generic[Variant]):
                 .where(Attempt.user_id == user.id)
                 .values(is_correct=False)
             )
+            await self.rebuild_scores(session, user.id)
 
         return RedirectResponse(
             request.url_for(f"networking:{self.slug}:page"), status_code=303
         )
 
 
-__all__ = ["BaseChapter", "ChapterTaskResult"]
+__all__ = [
+    "AttemptColumns",
+    "BaseChapter",
+    "ChapterTaskResult",
+    "index_attempts",
+]
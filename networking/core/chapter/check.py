@@ -1,33 +1,51 @@
 import asyncio
+import json
 import logging
+import time
 from dataclasses import dataclass
-from typing import Any, Awaitable, Callable, Protocol
+from typing import Any, AsyncIterator, Awaitable, Callable, Protocol
 
-import aiodocker
 from aiodocker.containers import DockerContainer
 from aiohttp import ClientTimeout
-from sqlalchemy import func, select
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import aliased
-from starlette.background import BackgroundTask
 from starlette.exceptions import HTTPException
 from starlette.requests import Request
-from starlette.responses import RedirectResponse, Response
+from starlette.responses import RedirectResponse, Response, StreamingResponse
 from starlette.routing import Route
 
 from quirck.auth.model import User
-from quirck.box.docker import lock_meta, run_container
+from quirck.box.docker import lock_meta
 from quirck.box.exception import DockerConflict
 from quirck.box.meta import ContainerMeta
 from quirck.box.model import DockerMeta, DockerState
 
+from networking.core.chapter.archive import read_log_archive
 from networking.core.chapter.base import BaseChapter
-from networking.core.model import Log
+from networking.core.config import CHECK_LOG_LIMIT
+from networking.core.database import get_sessionmaker
+from networking.core.job import (
+    enqueue_follow_up,
+    enqueue_job,
+    find_check_job,
+    job_status,
+)
+from networking.core.log import create_log, load_log_dictionaries
+from networking.core.model import Job, JobKind, JobState, Log
+from networking.core.pool import get_docker, start_container
+from networking.core.timing import Timings
 
 logger = logging.getLogger(__name__)
 
 CHECK_TIMEOUT = ClientTimeout(total=30, connect=30, sock_read=30, sock_connect=30)
 
+# Seconds between polls of the job table and until the client reconnects
+EVENTS_INTERVAL = 1
+EVENTS_DURATION = 300
+# Seconds between refreshes of the queue position, which ranks the whole queue
+EVENTS_POSITION_INTERVAL = 5
+FINAL_STATES = {JobState.DONE.value, JobState.FAILED.value}
+
 
 def check_default_log_joiner(container_logs: dict[int, str]) -> str:
     return "\n".join(container_logs[i] for i in sorted(container_logs.keys()))
@@ -45,16 +63,32 @@ class Check:
         | None
     ) = None
     logs_joiner: Callable[[dict[int, str]], str] = check_default_log_joiner
+    # Containers whose exit completes the check (all of them by default)
+    wait_for: list[int] | None = None
+    # Seconds to wait for them before reading logs anyway
+    timeout: float = 25
+    # Seconds given to the other containers to log what the waited ones sent
+    drain: float = 0
+    # Tasks the check writes attempts for, only its own by default
+    tasks: list[str] | None = None
 
 
 class CheckableTaskProtocol(Protocol):
-    checks: dict[str, Check]
+    # Keys of checks, listed without building them
+    check_names: list[str]
+
+    # Usually a cached property, built only for checks
+    @property
+    def checks(self) -> dict[str, Check]: ...
 
 
 class CheckableMixin(BaseChapter[CheckableTaskProtocol]):
     def __init__(self):
         super().__init__()
-        self.routes += [Route("/check", self.check, name="check", methods=["POST"])]
+        self.routes += [
+            Route("/check", self.check, name="check", methods=["POST"]),
+        ]
+        self.stream_routes += [Route("/events", self.events, name="events")]
 
     async def check(self, request: Request) -> Response:
         session: AsyncSession = request.scope["db"]
@@ -67,113 +101,230 @@ class CheckableMixin(BaseChapter[CheckableTaskProtocol]):
 
         form = await request.form()
         check = form.get("check")
-        if not isinstance(check, str) or check not in variant.checks:
+        if not isinstance(check, str) or check not in variant.check_names:
             return RedirectResponse(
                 request.url_for(f"networking:{self.slug}:page"), status_code=303
             )
 
-        try:
-            meta = await lock_meta(session, user.id, self.slug, True)
-            task = BackgroundTask(self.check_task, session, meta, check, variant)
-        except DockerConflict:
-            task = None
+        # Repeated presses attach to the queued run or add a single follow-up
+        queued = await find_check_job(
+            session, user.id, self.slug, check, JobState.QUEUED
+        )
+        if queued is None:
+            timings = Timings()
+            try:
+                with timings.phase("lock"):
+                    await lock_meta(session, user.id, self.slug, True)
+                await enqueue_job(
+                    session,
+                    JobKind.CHECK,
+                    user.id,
+                    self.slug,
+                    check,
+                    timings.as_json(),
+                )
+            except DockerConflict:
+                if await find_check_job(
+                    session, user.id, self.slug, check, JobState.RUNNING
+                ):
+                    await enqueue_follow_up(session, user.id, self.slug, check)
+
+            await session.commit()
 
         return RedirectResponse(
             f"{request.url_for(f'networking:{self.slug}:page')}#{check}",
             status_code=303,
-            background=task,
         )
 
+    async def run_job(
+        self, session: AsyncSession, meta: DockerMeta, job: Job, timings: Timings
+    ) -> None:
+        if job.kind != JobKind.CHECK or job.check is None:
+            return await super().run_job(session, meta, job, timings)
+
+        variant = await self.load_variant(session, job.user_id)
+        await self.check_task(session, meta, job.check, variant, timings)
+
+    async def events(self, request: Request) -> Response:
+        user: User = request.scope["user"]
+        session: AsyncSession = request.scope["db"]
+
+        if self.private and not user.is_admin:
+            raise HTTPException(403, "Доступ запрещён")
+
+        # The request session would keep its connection until the stream ends
+        user_id = user.id
+        await session.close()
+
+        return StreamingResponse(
+            self.stream_events(user_id),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    async def stream_events(self, user_id: int) -> AsyncIterator[str]:
+        # Short sessions, so that waiting pages do not hold connections. The
+        # current state is sent right away, the page compares it with its own.
+        last: dict[str, Any] | None = None
+        deadline = time.monotonic() + EVENTS_DURATION
+        position_due = time.monotonic()
+
+        while time.monotonic() < deadline:
+            with_position = time.monotonic() >= position_due
+            async with get_sessionmaker()() as session:
+                status = await job_status(session, user_id, self.slug, with_position)
+
+            if with_position:
+                position_due = time.monotonic() + EVENTS_POSITION_INTERVAL
+            elif (
+                status is not None
+                and last is not None
+                and status["id"] == last["id"]
+                and status["state"] == JobState.QUEUED.value
+            ):
+                status["position"] = last.get("position")
+
+            if status != last or last is None:
+                yield f"event: status\ndata: {json.dumps(status)}\n\n"
+                last = status
+            else:
+                yield ": waiting\n\n"
+
+            if status is None or status["state"] in FINAL_STATES:
+                return
+
+            await asyncio.sleep(EVENTS_INTERVAL)
+
     async def check_task(
         self,
         session: AsyncSession,
         meta: DockerMeta,
         check_name: str,
         variant: CheckableTaskProtocol,
+        timings: Timings | None = None,
     ) -> None:
         check = variant.checks[check_name]
+        timings = timings or Timings()
+        log: Log | None = None
+
+        with timings.phase("start"):
+            started = await asyncio.gather(
+                *[start_container(meta, container) for container in check.containers],
+                return_exceptions=True,
+            )
+        # quirck closes its client after the start, rebind containers to ours
+        client = get_docker()
         containers = [
-            await run_container(meta, container) for container in check.containers
+            client.containers.container(container.id)
+            for container in started
+            if not isinstance(container, BaseException)
         ]
 
-        async with aiodocker.Docker() as client:
-            # TODO: get rid of monkey-patch (how?)
-            for container in containers:
-                container.docker = client
+        try:
+            for result in started:
+                if isinstance(result, BaseException):
+                    raise result
+
+            waited = (
+                containers
+                if check.wait_for is None
+                else [containers[i] for i in check.wait_for]
+            )
 
             try:
-                await asyncio.gather(
-                    *[container.wait(timeout=25) for container in containers]
-                )
+                with timings.phase("wait"):
+                    async with asyncio.timeout(check.timeout):
+                        await asyncio.gather(
+                            *[
+                                container.wait(timeout=check.timeout)
+                                for container in waited
+                            ]
+                        )
             except Exception:
                 # If got timeout, try to do something anyway
                 logger.warning("Timed out when waiting for check %s", check_name)
                 pass
 
-            containers_logs: dict[int, str] = {}
-            for log_from, log_path in check.logs.items():
-                log_container = containers[log_from]
-                content = await log_container.get_archive(log_path)
-
-                log_content = ""
-                for member in content.getmembers():
-                    extracted = content.extractfile(member)
-                    if extracted is None:
-                        continue
-
-                    try:
-                        log_content += extracted.read().decode()
-                        log_content += "\n\n"
-                    except UnicodeDecodeError:
-                        log_content += f"File {member.name} cannot be decoded\n\n"
-
-                containers_logs[log_from] = log_content.strip()
-
-            log = Log(
-                user_id=meta.user_id,
-                chapter=self.slug,
-                check=check_name,
-                text=check.logs_joiner(containers_logs),
-            )
+            if check.drain:
+                with timings.phase("drain"):
+                    await asyncio.sleep(check.drain)
 
-            session.add(log)
+            # The budget is shared by all logs of the check
+            log_limit = CHECK_LOG_LIMIT // max(len(check.logs), 1)
 
-            if check.check is not None:
-                await check.check(session, meta, containers)
+            with timings.phase("archive"):
+                contents = await asyncio.gather(
+                    *[
+                        read_log_archive(containers[log_from], log_path, log_limit)
+                        for log_from, log_path in check.logs.items()
+                    ]
+                )
+            containers_logs = dict(zip(check.logs, contents))
+
+            with timings.phase("log"):
+                log = await create_log(
+                    session,
+                    meta.user_id,
+                    self.slug,
+                    check_name,
+                    check.logs_joiner(containers_logs),
+                )
 
-            for container in containers:
-                await container.delete(force=True)
+            if check.check is not None:
+                with timings.phase("verdict"):
+                    await check.check(session, meta, containers)
+        except BaseException:
+            # A failed statement leaves the transaction unusable, the lock is
+            # released in a new one
+            await session.rollback()
+            raise
+        finally:
+            # Started containers are removed even if others failed to start
+            with timings.phase("delete"):
+                await asyncio.gather(
+                    *[container.delete(force=True) for container in containers],
+                    return_exceptions=True,
+                )
 
             meta.state = DockerState.READY
-            await session.commit()
+            if log is not None:
+                log.timings = timings.as_json()
+
+            with timings.phase("commit"):
+                await session.commit()
 
     # No caching needed yet
     async def get_logs(self, request: Request) -> dict[str, Log]:
         user: User = request.scope["user"]
         session: AsyncSession = request.scope["db"]
+        variant = await self.get_variant(request)
 
-        window = (
-            func.row_number()
-            .over(
-                partition_by=(Log.chapter, Log.check),
-                order_by=Log.created.desc(),
-            )
-            .label("row")
-        )
-
-        subquery = select(Log, window).where(Log.user_id == user.id).alias("sq")
-        log_entity = aliased(Log, subquery)
+        # One index lookup on ix_log_latest per check
+        latest = [
+            select(Log.id)
+            .where(Log.user_id == user.id)
+            .where(Log.chapter == self.slug)
+            .where(Log.check == check)
+            .order_by(Log.created.desc())
+            .limit(1)
+            .scalar_subquery()
+            for check in variant.check_names
+        ]
 
-        logs = (
-            await session.scalars(select(log_entity).where(subquery.c.row == 1))
-        ).all()
+        logs = (await session.scalars(select(Log).where(Log.id.in_(latest)))).all()
+        await load_log_dictionaries(session, {log.dictionary_id for log in logs})
 
         return {log.check: log for log in logs}
 
     async def chapter_page(
         self, request: Request, context: dict[str, Any] = {}
     ) -> Response:
+        user: User = request.scope["user"]
+        session: AsyncSession = request.scope["db"]
+
         context["logs"] = await self.get_logs(request)
+        context["check_job"] = await job_status(session, user.id, self.slug)
+        context["events_url"] = request.url_for(f"networking:{self.slug}:events")
         return await super().chapter_page(request, context)
 
 
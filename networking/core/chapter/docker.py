@@ -1,7 +1,6 @@
 from typing import Protocol
 
 from sqlalchemy.ext.asyncio import AsyncSession
-from starlette.background import BackgroundTask
 from starlette.exceptions import HTTPException
 from starlette.requests import Request
 from starlette.responses import RedirectResponse, Response
@@ -11,12 +10,18 @@ from quirck.auth.model import User
 from quirck.box.docker import launch, lock_meta, stop_locked
 from quirck.box.exception import DockerConflict
 from quirck.box.meta import Deployment
+from quirck.box.model import DockerMeta
 
 from networking.core.chapter.base import BaseChapter
+from networking.core.job import enqueue_job
+from networking.core.model import Job, JobKind
+from networking.core.timing import Timings
 
 
 class DockerTaskProtocol(Protocol):
-    deployment: Deployment
+    # Usually a cached property, built only for launches
+    @property
+    def deployment(self) -> Deployment: ...
 
 
 class DockerMixin(BaseChapter[DockerTaskProtocol]):
@@ -34,18 +39,19 @@ class DockerMixin(BaseChapter[DockerTaskProtocol]):
         if self.private and not user.is_admin:
             raise HTTPException(403, "Доступ запрещён")
 
-        variant = await self.get_variant(request)
-
+        timings = Timings()
         try:
-            meta = await lock_meta(session, user.id, self.slug)
-            task = BackgroundTask(launch, session, meta, variant.deployment)
+            with timings.phase("lock"):
+                await lock_meta(session, user.id, self.slug)
+            await enqueue_job(
+                session, JobKind.LAUNCH, user.id, self.slug, timings=timings.as_json()
+            )
+            await session.commit()
         except DockerConflict:
-            task = None
+            pass
 
         return RedirectResponse(
-            request.url_for(f"networking:{self.slug}:page"),
-            status_code=303,
-            background=task,
+            request.url_for(f"networking:{self.slug}:page"), status_code=303
         )
 
     async def stop(self, request: Request) -> Response:
@@ -55,17 +61,35 @@ class DockerMixin(BaseChapter[DockerTaskProtocol]):
         if self.private and not user.is_admin:
             raise HTTPException(403, "Доступ запрещён")
 
+        timings = Timings()
         try:
-            meta = await lock_meta(session, user.id, self.slug)
-            task = BackgroundTask(stop_locked, session, meta)
+            with timings.phase("lock"):
+                await lock_meta(session, user.id, self.slug)
+            await enqueue_job(
+                session, JobKind.STOP, user.id, self.slug, timings=timings.as_json()
+            )
+            await session.commit()
         except DockerConflict:
-            task = None
+            pass
 
         return RedirectResponse(
-            request.url_for(f"networking:{self.slug}:page"),
-            status_code=303,
-            background=task,
+            request.url_for(f"networking:{self.slug}:page"), status_code=303
         )
 
+    async def run_job(
+        self, session: AsyncSession, meta: DockerMeta, job: Job, timings: Timings
+    ) -> None:
+        match job.kind:
+            case JobKind.LAUNCH:
+                variant = await self.load_variant(session, job.user_id)
+                deployment = variant.deployment
+                with timings.phase("launch"):
+                    await launch(session, meta, deployment)
+            case JobKind.STOP:
+                with timings.phase("stop"):
+                    await stop_locked(session, meta)
+            case _:
+                await super().run_job(session, meta, job, timings)
+
 
 __all__ = ["DockerMixin"]
@@ -21,15 +21,36 @@ class ParsedAttempt:
     is_correct: bool
 
 
+@dataclass
+class FormTask:
+    slug: str
+    form_class: type["BaseTaskForm"]
+    # Per-user data, set as attributes of the form instance
+    params: dict[str, Any]
+
+    async def bind(
+        self, request: Request, data: dict[str, Any] | None
+    ) -> "BaseTaskForm":
+        form = await self.form_class.from_formdata(request, prefix=self.slug, data=data)
+        form.slug = self.slug
+        for name, value in self.params.items():
+            setattr(form, name, value)
+
+        return form
+
+
 class BaseTaskForm(QuirckForm):
+    slug: str
+
     async def parse(self) -> list[ParsedAttempt]:
         raise NotImplementedError(
             f"{self.__class__.__name__} does not implement parse()"
         )
 
     @classmethod
-    def make_task(cls, slug: str, **kwargs) -> type["BaseTaskForm"]:
-        return type(slug, (cls,), kwargs)
+    def make_task(cls, slug: str, **params: Any) -> FormTask:
+        # Form classes are shared by all users, creating them is expensive
+        return FormTask(slug, cls, params)
 
 
 class SingleTaskForm(BaseTaskForm):
@@ -39,9 +60,7 @@ class SingleTaskForm(BaseTaskForm):
         )
 
     async def parse(self) -> list[ParsedAttempt]:
-        return [
-            ParsedAttempt(task=self.__class__.__name__, is_correct=await self.check())
-        ]
+        return [ParsedAttempt(task=self.slug, is_correct=await self.check())]
 
 
 class RegexpForm(SingleTaskForm):
@@ -53,7 +72,7 @@ class RegexpForm(SingleTaskForm):
 
 
 class FormTaskProtocol(Protocol):
-    form_classes: list[type[BaseTaskForm]]
+    forms: list[FormTask]
 
 
 class FormMixin(BaseChapter[FormTaskProtocol]):
@@ -68,15 +87,11 @@ class FormMixin(BaseChapter[FormTaskProtocol]):
 
         forms = {}
 
-        for form_class in variant.form_classes:
-            name = form_class.__name__
+        for task in variant.forms:
+            name = task.slug
 
-            last_attempt = next(
-                iter(attempt for attempt in attempts if attempt.task == name), None
-            )
-            form = await form_class.from_formdata(
-                request, prefix=name, data=last_attempt and last_attempt.data
-            )
+            last_attempt = next(iter(attempts.get(name, [])), None)
+            form = await task.bind(request, last_attempt and last_attempt.data)
 
             if form.submit.data:
                 if await form.validate_on_submit():
@@ -86,7 +101,7 @@ class FormMixin(BaseChapter[FormTaskProtocol]):
                         if key not in ["submit", "csrf_token"]
                     }
 
-                    attempts = [
+                    new_attempts = [
                         Attempt(
                             user_id=user.id,
                             chapter=self.slug,
@@ -97,9 +112,9 @@ class FormMixin(BaseChapter[FormTaskProtocol]):
                         for attempt in await form.parse()
                     ]
 
-                    session.add_all(attempts)
+                    await self.add_attempts(session, new_attempts)
 
-                    if any(attempt.is_correct for attempt in attempts):
+                    if any(attempt.is_correct for attempt in new_attempts):
                         return RedirectResponse(
                             f"{request.url_for(f'networking:{self.slug}:page')}#{name}",
                             status_code=303,
@@ -114,4 +129,4 @@ class FormMixin(BaseChapter[FormTaskProtocol]):
         return await super().chapter_page(request, context)
 
 
-__all__ = ["FormMixin", "BaseTaskForm", "RegexpForm"]
+__all__ = ["FormMixin", "FormTask", "BaseTaskForm", "RegexpForm"]
@@ -0,0 +1,39 @@
+from compression import zstd
+
+COMPRESSION_LEVEL = 9
+
+# Trained dictionaries by their id in the log_dictionary table
+dictionaries: dict[int, zstd.ZstdDict] = {}
+
+
+def add_dictionary(dictionary_id: int, data: bytes) -> None:
+    dictionaries[dictionary_id] = zstd.ZstdDict(data)
+
+
+def compress_text(text: str, dictionary_id: int | None = None) -> bytes:
+    return zstd.compress(
+        text.encode("utf-8"),
+        level=COMPRESSION_LEVEL,
+        zstd_dict=None if dictionary_id is None else dictionaries[dictionary_id],
+    )
+
+
+def decompress_text(data: bytes, dictionary_id: int | None = None) -> str:
+    return zstd.decompress(
+        data, zstd_dict=None if dictionary_id is None else dictionaries[dictionary_id]
+    ).decode("utf-8", errors="replace")
+
+
+def train_dictionary(samples: list[str], size: int) -> bytes:
+    return zstd.train_dict(
+        [sample.encode("utf-8") for sample in samples], size
+    ).dict_content
+
+
+__all__ = [
+    "dictionaries",
+    "add_dictionary",
+    "compress_text",
+    "decompress_text",
+    "train_dictionary",
+]
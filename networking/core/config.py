@@ -8,4 +8,29 @@ SOCKET_PATH = config("SOCKET_PATH", cast=str)
 
 EXTERNAL_BASE_URL = config("EXTERNAL_BASE_URL", cast=str)
 
+DOCKER_HOST = config("DOCKER_HOST", cast=str, default="unix:///var/run/docker.sock")
+DOCKER_CONNECTIONS = config("DOCKER_CONNECTIONS", cast=int, default=32)
+
+# image=size[:max_idle],... e.g. ct-itmo/labs-networking-dns-bot=4:3600
+CHECK_POOL = config("CHECK_POOL", cast=str, default="")
+CHECK_LOG_LIMIT = config("CHECK_LOG_LIMIT", cast=int, default=256 * 1024)
+
+WORKER_CONCURRENCY = config("WORKER_CONCURRENCY", cast=int, default=8)
+JOB_POLL_INTERVAL = config("JOB_POLL_INTERVAL", cast=float, default=1.0)
+JOB_HEARTBEAT_INTERVAL = config("JOB_HEARTBEAT_INTERVAL", cast=float, default=10.0)
+JOB_STALE_AFTER = config("JOB_STALE_AFTER", cast=int, default=60)
+JOB_MAX_TRIES = config("JOB_MAX_TRIES", cast=int, default=3)
+# Days finished jobs are kept, the timings page looks back up to them
+JOB_RETENTION = config("JOB_RETENTION", cast=int, default=30)
+# Seconds a follow-up check waits before trying to take a busy lock again
+JOB_CONFLICT_DELAY = config("JOB_CONFLICT_DELAY", cast=float, default=2.0)
+# Seconds since it was queued after which it fails instead
+JOB_CONFLICT_TIMEOUT = config("JOB_CONFLICT_TIMEOUT", cast=int, default=120)
+
+VARIANT_CACHE_SIZE = config("VARIANT_CACHE_SIZE", cast=int, default=1024)
+
 SCOREBOARD_TOKEN = config("SCOREBOARD_TOKEN", cast=Secret, default=None)
+SCOREBOARD_CACHE_TTL = config("SCOREBOARD_CACHE_TTL", cast=int, default=60)
+
+LOG_RETENTION = config("LOG_RETENTION", cast=int, default=20)
+LOG_ARCHIVE_PATH = config("LOG_ARCHIVE_PATH", cast=str, default="log-archive")
@@ -0,0 +1,30 @@
+import functools
+
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+
+from quirck.core import config
+from quirck.db.base import Base
+
+
+# Engine for code running outside of a request: commands and background jobs
+@functools.cache
+def get_engine() -> AsyncEngine:
+    return create_async_engine(str(config.DATABASE_URL))
+
+
+@functools.cache
+def get_sessionmaker() -> async_sessionmaker[AsyncSession]:
+    return async_sessionmaker(get_engine(), expire_on_commit=False)
+
+
+async def create_tables() -> None:
+    async with get_engine().begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+
+
+__all__ = ["get_engine", "get_sessionmaker", "create_tables"]
@@ -0,0 +1,202 @@
+import csv
+import io
+import json
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, AsyncIterator, Callable
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.exceptions import HTTPException
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+from quirck.auth.model import User
+
+from networking.chapters import chapters
+from networking.core.model import Attempt, Exam, TaskScore
+
+# Rows fetched from the server-side cursor at once
+EXPORT_BATCH_SIZE = 1000
+# Size of a response chunk
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+
+def export_value(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+async def stream_csv(
+    header: list[str], rows: AsyncIterator[list[Any]]
+) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+
+    async for row in rows:
+        writer.writerow(
+            json.dumps(value) if isinstance(value, dict) else export_value(value)
+            for value in row
+        )
+
+        if buffer.tell() >= EXPORT_CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
+
+
+async def stream_json(
+    header: list[str], rows: AsyncIterator[list[Any]]
+) -> AsyncIterator[str]:
+    chunk = "["
+    separator = "\n"
+
+    async for row in rows:
+        chunk += separator + json.dumps(
+            dict(zip(header, row)), ensure_ascii=False, default=export_value
+        )
+        separator = ",\n"
+
+        if len(chunk) >= EXPORT_CHUNK_SIZE:
+            yield chunk
+            chunk = ""
+
+    yield chunk + "\n]\n"
+
+
+def export_response(
+    request: Request,
+    name: str,
+    header: list[str],
+    rows: Callable[[AsyncSession], AsyncIterator[list[Any]]],
+) -> Response:
+    user: User = request.scope["user"]
+    if not user.is_admin:
+        raise HTTPException(403)
+
+    session: AsyncSession = request.scope["db"]
+
+    match request.query_params.get("format", "csv"):
+        case "csv":
+            content, media_type, extension = stream_csv, "text/csv", "csv"
+        case "json":
+            content, media_type, extension = stream_json, "application/json", "json"
+        case _:
+            raise HTTPException(400, "Unknown format")
+
+    return StreamingResponse(
+        content(header, rows(session)),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="{name}.{extension}"'
+        },
+    )
+
+
+def scoreboard_header() -> list[str]:
+    return ["id", "name", "points", "test_points", "final_points"] + [
+        f"{chapter.slug}:{task.slug}" for chapter in chapters for task in chapter.tasks
+    ]
+
+
+def scoreboard_row(
+    user_id: int, name: str, exam: Exam | None, scores: dict[str, dict[str, TaskScore]]
+) -> list[Any]:
+    user_chapters = [
+        chapter.calculate_stored_score(
+            scores.get(chapter.slug, {}), False if exam is None else exam.has_debt
+        )
+        for chapter in chapters
+    ]
+    chapter_score = sum((chapter.score for chapter in user_chapters), Decimal(0))
+
+    return [
+        user_id,
+        name,
+        chapter_score if exam is None else exam.calculate_points(chapter_score),
+        None if exam is None else exam.test_points,
+        None if exam is None else exam.final_points,
+    ] + [result.score for chapter in user_chapters for result in chapter.results]
+
+
+async def scoreboard_rows(session: AsyncSession) -> AsyncIterator[list[Any]]:
+    result = await session.stream(
+        select(User.id, User.name, Exam, TaskScore)
+        .outerjoin(Exam, Exam.user_id == User.id)
+        .outerjoin(TaskScore, TaskScore.user_id == User.id)
+        .order_by(User.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+
+    # Rows of the same user are adjacent, so only one user is kept in memory
+    current: tuple[int, str, Exam | None] | None = None
+    scores: dict[str, dict[str, TaskScore]] = {}
+
+    async for user_id, name, exam, score in result:
+        if current is not None and current[0] != user_id:
+            yield scoreboard_row(*current, scores)
+            scores = {}
+
+        current = (user_id, name, exam)
+        if score is not None:
+            scores.setdefault(score.chapter, {})[score.task] = score
+
+    if current is not None:
+        yield scoreboard_row(*current, scores)
+
+
+ATTEMPT_COLUMNS = [
+    Attempt.id,
+    Attempt.submitted,
+    Attempt.user_id,
+    Attempt.chapter,
+    Attempt.task,
+    Attempt.is_correct,
+    Attempt.points,
+    Attempt.data,
+]
+
+
+async def attempt_rows(session: AsyncSession) -> AsyncIterator[list[Any]]:
+    result = await session.stream(
+        select(*ATTEMPT_COLUMNS)
+        .order_by(Attempt.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+
+    async for row in result:
+        yield list(row)
+
+
+async def export_scoreboard(request: Request) -> Response:
+    return export_response(request, "scoreboard", scoreboard_header(), scoreboard_rows)
+
+
+async def export_attempts(request: Request) -> Response:
+    return export_response(
+        request,
+        "attempts",
+        [column.key for column in ATTEMPT_COLUMNS],
+        attempt_rows,
+    )
+
+
+def get_export_mount() -> Mount:
+    return Mount(
+        "/export",
+        routes=[
+            Route("/scoreboard", export_scoreboard, name="scoreboard"),
+            Route("/attempts", export_attempts, name="attempts"),
+        ],
+        name="export",
+    )
+
+
+__all__ = ["get_export_mount"]
@@ -0,0 +1,460 @@
+import argparse
+import io
+import json
+import logging
+import re
+import sys
+import tarfile
+import time
+import tracemalloc
+from datetime import datetime
+from hashlib import sha256
+from pathlib import Path, PurePosixPath
+from random import Random
+from typing import Any, Callable, Coroutine, Sequence, get_type_hints
+
+from aiodocker.exceptions import DockerError
+from netaddr import IPNetwork
+from starlette.datastructures import Secret
+
+from quirck.box.meta import ContainerMeta
+from quirck.box.model import DockerMeta
+
+from networking.chapters import chapters
+from networking.core import config, util
+from networking.core.chapter.base import BaseChapter
+from networking.core.chapter.check import Check
+from networking.core.model import Attempt
+
+logger = logging.getLogger(__name__)
+
+# Golden outputs guard students' assignments: generated values must not change
+# mid-semester, even when the generators are optimized
+UTIL_SECTION = "util"
+GOLDEN_PATH = Path(__file__).with_name("variants.golden.json")
+
+# Recordings are made with this configuration instead of the deployment's one,
+# so that they can be committed and verified anywhere. DNS answers are given
+# both as strings and compiled, as trees before precomputed variants used them.
+GOLDEN_CONFIG: dict[str, Any] = {
+    "SECRET_SEED": Secret("golden"),
+    "SOCKET_PATH": "/run/networking.sock",
+    "EXTERNAL_BASE_URL": "http://localhost:12003",
+    "DNS_REGEXP_IP": "^golden-ip$",
+    "DNS_REGEXP_SERVERS": "^golden-servers$",
+    "DNS_ANSWER_IP": re.compile("^golden-ip$", re.I),
+    "DNS_ANSWER_SERVERS": re.compile("^golden-servers$", re.I),
+}
+
+# Files served to verdicts, formatted with the variant's attributes. Every
+# container of every check in the chapter gets the same files. Port 1999 is
+# never allowed, generated ports are 2001-3000.
+VERDICT_SAMPLES: dict[str, list[dict[str, str]]] = {
+    "dhcpd": [
+        {"/out/addresses": "{ip4_net}\n{ip6_net}\n"},
+        {"/out/addresses": "10.255.255.1/24\nfe80::1/64\n"},
+        {},
+    ],
+    "firewall": [
+        {
+            "/out/result": "OK\n",
+            "/out/check.log": (
+                "[UDP {ip4_b_client2}:3001] received message\n"
+                "[UDP {ip4_b_client2}:{allow_udp_port2}] received message\n"
+            ),
+        },
+        {
+            "/out/result": "OK\n",
+            "/out/check.log": "[UDP {ip4_b_client2}:1999] received message\n",
+        },
+        {"/out/result": "FAIL\n"},
+    ],
+}
+# Stands for the server default of Attempt.submitted
+SAMPLE_SUBMITTED = datetime(2026, 1, 1)
+
+
+def describe_container(container: ContainerMeta) -> dict[str, Any]:
+    return {
+        "name": container.name,
+        "image": container.image,
+        "networks": [
+            [network.network_name, network.mac_address, network.sysctls]
+            for network in container.networks
+        ],
+        "environment": container.environment,
+        "volumes": container.volumes,
+        "mem_limit": container.mem_limit,
+        "ipv6_forwarding": container.ipv6_forwarding,
+    }
+
+
+def use_golden_config() -> None:
+    # Replaces the configuration imported by the generators. Only for processes
+    # that never serve users.
+    for name, module in list(sys.modules.items()):
+        if name.startswith("networking."):
+            for key, value in GOLDEN_CONFIG.items():
+                if hasattr(module, key):
+                    setattr(module, key, value)
+
+
+class SampleContainer:
+    # Serves sample files to verdicts instead of a stopped container
+    def __init__(self, files: dict[str, bytes]):
+        self.files = files
+
+    async def get_archive(self, path: str) -> tarfile.TarFile:
+        if path not in self.files:
+            raise DockerError(404, {"message": f"Could not find the file {path}"})
+
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w") as tar:
+            info = tarfile.TarInfo(PurePosixPath(path).name)
+            info.size = len(self.files[path])
+            tar.addfile(info, io.BytesIO(self.files[path]))
+
+        buffer.seek(0)
+        return tarfile.open(fileobj=buffer)
+
+
+class RecordingSession:
+    # Keeps attempts added by verdicts, statements are not run
+    def __init__(self):
+        self.attempts: list[Attempt] = []
+
+    def add_all(self, attempts: Sequence[Attempt]) -> None:
+        self.attempts.extend(attempts)
+
+    async def flush(self) -> None:
+        for attempt in self.attempts:
+            attempt.submitted = attempt.submitted or SAMPLE_SUBMITTED
+
+    async def execute(self, statement: Any) -> None:
+        pass
+
+    async def commit(self) -> None:
+        pass
+
+
+def run_now(coroutine: Coroutine[Any, Any, None]) -> None:
+    # Verdicts only wait for the samples, so they finish in a single step
+    try:
+        coroutine.send(None)
+    except StopIteration:
+        return
+
+    coroutine.close()
+    raise RuntimeError("Verdict waited for something else than its samples")
+
+
+def describe_verdict(
+    chapter: BaseChapter, check: Check, user_id: int, variant: Any
+) -> list[list[Any]] | None:
+    # Verdicts are compared by the attempts they add for the sample files
+    if check.check is None:
+        return None
+
+    outputs = []
+    for sample in VERDICT_SAMPLES.get(chapter.slug, []):
+        files = {
+            path: template.format(**vars(variant)).encode("utf-8")
+            for path, template in sample.items()
+        }
+        session = RecordingSession()
+        containers = [SampleContainer(files) for _ in check.containers]
+        run_now(
+            check.check(
+                session,  # type: ignore[arg-type]
+                DockerMeta(user_id=user_id),
+                containers,  # type: ignore[arg-type]
+            )
+        )
+        outputs.append(
+            sorted(
+                [attempt.task, attempt.is_correct, str(attempt.points), attempt.data]
+                for attempt in session.attempts
+            )
+        )
+
+    return outputs
+
+
+def describe_check(
+    chapter: BaseChapter, check: Check, user_id: int, variant: Any
+) -> dict[str, Any]:
+    # Waiting settings are the same for every user and are left out
+    return {
+        "containers": [describe_container(container) for container in check.containers],
+        "logs": check.logs,
+        "verdict": describe_verdict(chapter, check, user_id, variant),
+        # Joiners are usually lambdas, so their output is compared instead
+        "joined": check.logs_joiner({index: f"<{index}>" for index in check.logs}),
+    }
+
+
+def make_variant(chapter: BaseChapter, user_id: int) -> Any:
+    # Before precomputed variants, chapters built them from the user id in
+    # get_variant, so the recording can be made from that tree too
+    if hasattr(chapter, "generate_params"):
+        return chapter.make_variant(user_id)
+
+    return get_type_hints(type(chapter).get_variant)["return"](user_id)
+
+
+def seed_fingerprint() -> str:
+    return sha256(str(config.SECRET_SEED).encode("utf-8")).hexdigest()[:16]
+
+
+def describe_variant(chapter: BaseChapter, user_id: int) -> dict[str, Any]:
+    # Parameters are left out, they differ between trees and only matter
+    # through the values derived from them
+    variant = make_variant(chapter, user_id)
+
+    description: dict[str, Any] = {
+        "forms": [
+            [
+                task.slug,
+                task.params.get("answer")
+                and [task.params["answer"].pattern, task.params["answer"].flags],
+            ]
+            for task in getattr(variant, "forms", [])
+        ],
+    }
+
+    if hasattr(variant, "deployment"):
+        description["deployment"] = {
+            "containers": [
+                describe_container(container)
+                for container in variant.deployment.containers
+            ],
+            "networks": [network.name for network in variant.deployment.networks],
+        }
+
+    if hasattr(variant, "checks"):
+        check_names = getattr(variant, "check_names", list(variant.checks))
+        if list(variant.checks) != check_names:
+            raise SystemExit(f"check_names of {chapter.slug} differ from its checks")
+
+        description["checks"] = {
+            name: describe_check(chapter, check, user_id, variant)
+            for name, check in variant.checks.items()
+        }
+
+    return description
+
+
+def describe_util(user_id: int) -> dict[str, Any]:
+    rnd = Random(f"golden-{user_id}")
+    network4 = util.generate_subnet(rnd, IPNetwork("10.0.0.0/8"), 24)
+    network6 = util.generate_subnet(rnd, IPNetwork("fd00::/8"), 64)
+
+    return {
+        "mac": str(util.generate_mac(rnd)),
+        "subnet4": str(network4),
+        "subnet6": str(network6),
+        "subnet_same": str(util.generate_subnet(rnd, network4, 24)),
+        "address4": str(util.generate_address(rnd, network4)),
+        "address6": str(util.generate_address(rnd, network6)),
+        "address_no_gateway": str(
+            util.generate_address(rnd, IPNetwork("10.0.0.0/30"), no_gateway=True)
+        ),
+        "address_single": str(util.generate_address(rnd, IPNetwork("10.0.0.1/32"))),
+        # Small ranges make collisions, and so regenerations, likely
+        "distinct_addresses": [
+            str(address)
+            for address in util.generate_distinct(
+                4, util.generate_address, rnd, IPNetwork("10.0.0.0/29")
+            )
+        ],
+        "distinct_ports": list(util.generate_distinct(10, rnd.randint, 1, 30)),
+        "distinct_macs": [
+            str(mac) for mac in util.generate_distinct(5, util.generate_mac, rnd)
+        ],
+    }
+
+
+def digest(value: Any) -> str:
+    # Shortened, the recording is committed
+    encoded = json.dumps(value, sort_keys=True).encode("utf-8")
+    return sha256(encoded).hexdigest()[:16]
+
+
+def sections(
+    chapter_slugs: list[str] | None,
+) -> dict[str, Callable[[int], dict[str, Any]]]:
+    selected: dict[str, Callable[[int], dict[str, Any]]] = {
+        UTIL_SECTION: describe_util
+    }
+    for chapter in chapters:
+        selected[chapter.slug] = (
+            lambda user_id, chapter=chapter: describe_variant(chapter, user_id)
+        )
+
+    if chapter_slugs is None:
+        return selected
+
+    unknown = set(chapter_slugs) - selected.keys()
+    if unknown:
+        raise SystemExit(f"Unknown sections: {', '.join(sorted(unknown))}")
+
+    return {slug: selected[slug] for slug in chapter_slugs}
+
+
+def record(args: argparse.Namespace) -> None:
+    golden = {
+        "seed": seed_fingerprint(),
+        "users": args.users,
+        "digests": {
+            name: [digest(describe(user_id)) for user_id in range(1, args.users + 1)]
+            for name, describe in sections(args.section).items()
+        },
+    }
+
+    Path(args.path).write_text(json.dumps(golden, indent=1), encoding="utf-8")
+    logger.info("Recorded %d users to %s", args.users, args.path)
+
+
+def verify(args: argparse.Namespace) -> None:
+    mismatches = verify_recording(Path(args.path), args.section, args.show)
+    if mismatches:
+        raise SystemExit(f"Found {mismatches} changed outputs")
+
+
+def verify_recording(path: Path, section: list[str] | None, show: int) -> int:
+    if not path.exists():
+        logger.error(
+            "No golden outputs in %s, record them with "
+            "python -m networking.core.golden record",
+            path,
+        )
+        return 1
+
+    golden = json.loads(path.read_text(encoding="utf-8"))
+    if golden["seed"] != seed_fingerprint():
+        logger.error("Golden outputs were recorded with another seed")
+        return 1
+
+    mismatches = 0
+    for name, describe in sections(section).items():
+        if name not in golden["digests"]:
+            logger.error("No golden outputs for %s", name)
+            mismatches += 1
+            continue
+
+        for user_id, expected in enumerate(golden["digests"][name], start=1):
+            description = describe(user_id)
+            if digest(description) != expected:
+                mismatches += 1
+                if mismatches <= show:
+                    logger.error(
+                        "Mismatch in %s for user %d, now: %s",
+                        name,
+                        user_id,
+                        json.dumps(description, sort_keys=True),
+                    )
+
+        logger.info("Verified %s", name)
+
+    if not mismatches:
+        logger.info("All outputs of %d users match", golden["users"])
+
+    return mismatches
+
+
+def measure(func: Callable[[int], Any], users: int) -> tuple[float, float]:
+    # Mean seconds and mean peak of allocated bytes per call. Allocations are
+    # traced in a separate pass to keep timings clean.
+    start = time.perf_counter()
+    for user_id in range(1, users + 1):
+        func(user_id)
+    elapsed = time.perf_counter() - start
+
+    allocated = 0
+    tracemalloc.start()
+    try:
+        for user_id in range(1, users + 1):
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            func(user_id)
+            _, peak = tracemalloc.get_traced_memory()
+            allocated += peak - before
+    finally:
+        tracemalloc.stop()
+
+    return elapsed / users, allocated / users
+
+
+def benchmark(args: argparse.Namespace) -> None:
+    stages: list[tuple[str, Callable[[int], Any]]] = [("util", describe_util)]
+    for chapter in chapters:
+        if args.section is not None and chapter.slug not in args.section:
+            continue
+
+        params = {
+            user_id: chapter.generate_params(user_id)
+            for user_id in range(1, args.users + 1)
+        }
+        stages += [
+            (f"{chapter.slug}.generate", chapter.generate_params),
+            (
+                f"{chapter.slug}.build",
+                lambda user_id, chapter=chapter, params=params: (
+                    chapter.build_variant(user_id, params[user_id])
+                ),
+            ),
+            (
+                f"{chapter.slug}.full",
+                lambda user_id, chapter=chapter: describe_variant(chapter, user_id),
+            ),
+        ]
+
+    for name, func in stages:
+        seconds, allocated = measure(func, args.users)
+        logger.info(
+            "%-24s %9.1f us %9.1f KiB", name, seconds * 1e6, allocated / 1024
+        )
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m networking.core.golden")
+    parser.add_argument(
+        "--section",
+        action="append",
+        help="util or a chapter slug, may be repeated (all by default)",
+    )
+    commands = parser.add_subparsers(required=True)
+
+    command = commands.add_parser(
+        "record", help="save digests of generated values for the first users"
+    )
+    command.add_argument("--users", type=int, default=1000)
+    command.add_argument("--path", default=GOLDEN_PATH)
+    command.set_defaults(handler=record)
+
+    command = commands.add_parser(
+        "verify", help="fail if any generated value differs from the recording"
+    )
+    command.add_argument("--path", default=GOLDEN_PATH)
+    command.add_argument(
+        "--show", type=int, default=5, help="mismatching outputs to print"
+    )
+    command.set_defaults(handler=verify)
+
+    command = commands.add_parser(
+        "benchmark", help="report time and memory of variant generation"
+    )
+    command.add_argument("--users", type=int, default=1000)
+    command.set_defaults(handler=benchmark)
+
+    return parser
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = build_parser().parse_args()
+    use_golden_config()
+    args.handler(args)
+
+
+__all__ = ["build_parser", "describe_variant", "use_golden_config", "verify_recording"]
@@ -0,0 +1,312 @@
+from datetime import timedelta
+from typing import Any
+
+from sqlalchemy import (
+    ColumnElement,
+    cast,
+    delete,
+    exists,
+    func,
+    literal_column,
+    or_,
+    select,
+    update,
+)
+from sqlalchemy.dialects.postgresql import JSONB, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from quirck.box.model import DockerMeta, DockerState
+
+from networking.core.model import Job, JobKind, JobState, TaskScore
+
+
+def merge_timings(timings: ColumnElement[Any]) -> ColumnElement[Any]:
+    # Phases are recorded by the web request, at claim time and by the worker
+    return func.coalesce(Job.timings, cast({}, JSONB)).op("||")(timings)
+
+
+def claim_order():
+    # Queued jobs ranked so that users take turns
+    return (
+        select(
+            Job.id,
+            Job.user_id,
+            Job.chapter,
+            func.row_number()
+            .over(partition_by=Job.user_id, order_by=Job.created)
+            .label("turn"),
+            Job.created,
+        )
+        .where(Job.state == JobState.QUEUED)
+        .subquery()
+    )
+
+
+async def enqueue_job(
+    session: AsyncSession,
+    kind: JobKind,
+    user_id: int,
+    chapter: str,
+    check: str | None = None,
+    timings: dict[str, float] | None = None,
+) -> Job:
+    job = Job(
+        kind=kind, user_id=user_id, chapter=chapter, check=check, timings=timings
+    )
+    session.add(job)
+    await session.flush()
+    return job
+
+
+async def find_check_job(
+    session: AsyncSession, user_id: int, chapter: str, check: str, state: JobState
+) -> Job | None:
+    return await session.scalar(
+        select(Job)
+        .where(Job.kind == JobKind.CHECK)
+        .where(Job.user_id == user_id)
+        .where(Job.chapter == chapter)
+        .where(Job.check == check)
+        .where(Job.state == state)
+        .limit(1)
+    )
+
+
+async def enqueue_follow_up(
+    session: AsyncSession, user_id: int, chapter: str, check: str
+) -> None:
+    await session.execute(
+        insert(Job)
+        .values(
+            kind=JobKind.CHECK,
+            user_id=user_id,
+            chapter=chapter,
+            check=check,
+            follow_up=True,
+            state=JobState.QUEUED,
+        )
+        .on_conflict_do_nothing(
+            index_elements=[Job.user_id, Job.chapter, Job.check],
+            index_where=(Job.kind == JobKind.CHECK) & (Job.state == JobState.QUEUED),
+        )
+    )
+
+
+async def claim_job(session: AsyncSession) -> Job | None:
+    ranked = claim_order()
+    running = aliased(Job)
+
+    job = await session.scalar(
+        select(Job)
+        .join(ranked, ranked.c.id == Job.id)
+        # Follow-ups wait for the run they follow
+        .where(
+            ~exists()
+            .where(running.user_id == Job.user_id)
+            .where(running.state == JobState.RUNNING)
+        )
+        .where(or_(Job.not_before.is_(None), Job.not_before <= func.now()))
+        .order_by(ranked.c.turn, ranked.c.created)
+        .limit(1)
+        .with_for_update(skip_locked=True, of=Job)
+    )
+    if job is None:
+        return None
+
+    await session.execute(
+        update(Job)
+        .where(Job.id == job.id)
+        .values(
+            state=JobState.RUNNING,
+            started=func.now(),
+            heartbeat=func.now(),
+            tries=Job.tries + 1,
+            timings=merge_timings(
+                func.jsonb_build_object(
+                    literal_column("'queue'"),
+                    func.extract("epoch", func.now() - Job.created),
+                )
+            ),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+    return job
+
+
+async def finish_job(
+    session: AsyncSession,
+    job_id: int,
+    state: JobState,
+    error: str | None = None,
+    timings: dict[str, float] | None = None,
+) -> None:
+    await session.execute(
+        update(Job)
+        .where(Job.id == job_id)
+        .values(
+            state=state,
+            finished=func.now(),
+            error=error,
+            timings=merge_timings(cast(timings or {}, JSONB)),
+        )
+    )
+
+
+async def requeue_job(session: AsyncSession, job_id: int, delay: float) -> bool:
+    # The job could not start, so the try is not counted. Not done if the same
+    # check has been queued again meanwhile, that run replaces this one.
+    queued = aliased(Job)
+    result = await session.execute(
+        update(Job)
+        .where(Job.id == job_id)
+        .where(
+            ~exists()
+            .where(queued.user_id == Job.user_id)
+            .where(queued.chapter == Job.chapter)
+            .where(queued.check == Job.check)
+            .where(queued.kind == Job.kind)
+            .where(queued.state == JobState.QUEUED)
+        )
+        .values(
+            state=JobState.QUEUED,
+            tries=Job.tries - 1,
+            started=None,
+            heartbeat=None,
+            not_before=func.now() + timedelta(seconds=delay),
+        )
+    )
+    return result.rowcount > 0
+
+
+async def conflict_expired(session: AsyncSession, job_id: int, timeout: int) -> bool:
+    # A lock that is never released, e.g. of a stopped deployment, must not
+    # keep the job requeued forever
+    return bool(
+        await session.scalar(
+            select(Job.created < func.now() - timedelta(seconds=timeout)).where(
+                Job.id == job_id
+            )
+        )
+    )
+
+
+async def touch_jobs(session: AsyncSession, job_ids: set[int]) -> None:
+    if job_ids:
+        await session.execute(
+            update(Job).where(Job.id.in_(job_ids)).values(heartbeat=func.now())
+        )
+
+
+async def recover_jobs(session: AsyncSession, stale_after: int, max_tries: int) -> None:
+    # Jobs of a crashed worker keep the user's lock, so they are run again
+    stale = (
+        Job.state == JobState.RUNNING,
+        Job.heartbeat < func.now() - timedelta(seconds=stale_after),
+    )
+
+    await session.execute(
+        update(Job)
+        .where(*stale, Job.tries < max_tries)
+        .values(state=JobState.QUEUED)
+    )
+
+    failed = (
+        await session.execute(
+            update(Job)
+            .where(*stale)
+            .values(state=JobState.FAILED, finished=func.now(), error="Worker lost")
+            .returning(Job.kind, Job.user_id)
+        )
+    ).all()
+
+    await release_meta(session, [user_id for _, user_id in failed])
+
+
+async def prune_jobs(session: AsyncSession, retention: int) -> None:
+    # Finished jobs are only kept for timings and regrades
+    await session.execute(
+        delete(Job)
+        .where(Job.state.in_([JobState.DONE, JobState.FAILED]))
+        .where(Job.created < func.now() - timedelta(days=retention))
+    )
+
+
+async def release_meta(session: AsyncSession, user_ids: list[int]) -> None:
+    # Called for every job failing for good, whatever its kind. A deployment
+    # left half launched or stopped is fixed by launching or stopping again,
+    # which needs the lock.
+    if user_ids:
+        await session.execute(
+            update(DockerMeta)
+            .where(DockerMeta.user_id.in_(user_ids))
+            .values(state=DockerState.READY)
+        )
+
+
+async def queue_position(
+    session: AsyncSession, user_id: int, chapter: str
+) -> int | None:
+    ranked = claim_order()
+
+    queued = await session.execute(
+        select(ranked.c.user_id, ranked.c.chapter).order_by(
+            ranked.c.turn, ranked.c.created
+        )
+    )
+    for position, (job_user_id, job_chapter) in enumerate(queued, 1):
+        if job_user_id == user_id and job_chapter == chapter:
+            return position
+
+    return None
+
+
+async def job_status(
+    session: AsyncSession, user_id: int, chapter: str, with_position: bool = True
+) -> dict[str, Any] | None:
+    # State of the latest job of the user in the chapter, as sent to the page
+    job = await session.scalar(
+        select(Job)
+        .where(Job.user_id == user_id)
+        .where(Job.chapter == chapter)
+        .order_by(Job.id.desc())
+        .limit(1)
+    )
+    if job is None:
+        return None
+
+    status: dict[str, Any] = {
+        "id": job.id,
+        "kind": job.kind.value,
+        "check": job.check,
+        "state": job.state.value,
+    }
+    if job.state == JobState.QUEUED and with_position:
+        status["position"] = await queue_position(session, user_id, chapter)
+    if job.state == JobState.DONE and job.check is not None:
+        status["solved"] = await session.scalar(
+            select(TaskScore.is_solved)
+            .where(TaskScore.user_id == user_id)
+            .where(TaskScore.chapter == chapter)
+            .where(TaskScore.task == job.check)
+        )
+
+    return status
+
+
+__all__ = [
+    "claim_job",
+    "conflict_expired",
+    "enqueue_follow_up",
+    "enqueue_job",
+    "find_check_job",
+    "finish_job",
+    "job_status",
+    "prune_jobs",
+    "queue_position",
+    "recover_jobs",
+    "release_meta",
+    "requeue_job",
+    "touch_jobs",
+]
@@ -0,0 +1,195 @@
+import json
+import logging
+from pathlib import Path
+from typing import Iterable
+
+from sqlalchemy import delete, func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from networking.core.compression import (
+    add_dictionary,
+    compress_text,
+    dictionaries,
+    train_dictionary,
+)
+from networking.core.model import Log, LogDictionary
+
+logger = logging.getLogger(__name__)
+
+
+async def load_log_dictionaries(
+    session: AsyncSession, dictionary_ids: Iterable[int | None]
+) -> None:
+    missing = {
+        dictionary_id
+        for dictionary_id in dictionary_ids
+        if dictionary_id is not None and dictionary_id not in dictionaries
+    }
+    if not missing:
+        return
+
+    for dictionary in await session.scalars(
+        select(LogDictionary).where(LogDictionary.id.in_(missing))
+    ):
+        add_dictionary(dictionary.id, dictionary.data)
+
+
+async def get_current_dictionary(session: AsyncSession) -> int | None:
+    dictionary_id = await session.scalar(select(func.max(LogDictionary.id)))
+    await load_log_dictionaries(session, [dictionary_id])
+    return dictionary_id
+
+
+async def create_log(
+    session: AsyncSession, user_id: int, chapter: str, check: str, text: str
+) -> Log:
+    dictionary_id = await get_current_dictionary(session)
+
+    log = Log(
+        user_id=user_id,
+        chapter=chapter,
+        check=check,
+        compressed=compress_text(text, dictionary_id),
+        dictionary_id=dictionary_id,
+    )
+    session.add(log)
+
+    return log
+
+
+async def train_log_dictionary(
+    session: AsyncSession, sample_count: int, size: int
+) -> int:
+    logs = (
+        await session.scalars(select(Log).order_by(Log.id.desc()).limit(sample_count))
+    ).all()
+    await load_log_dictionaries(session, {log.dictionary_id for log in logs})
+
+    dictionary = LogDictionary(data=train_dictionary([log.text for log in logs], size))
+    session.add(dictionary)
+    await session.commit()
+
+    logger.info("Trained dictionary %d on %d logs", dictionary.id, len(logs))
+    return dictionary.id
+
+
+async def compress_logs(
+    session: AsyncSession, batch_size: int, recompress: bool = False
+) -> int:
+    # Compresses plain logs, and with `recompress` also logs using older dictionaries
+    dictionary_id = await get_current_dictionary(session)
+
+    condition = Log.plain_text.is_not(None)
+    if recompress and dictionary_id is not None:
+        condition = or_(
+            condition,
+            Log.dictionary_id.is_(None),
+            Log.dictionary_id != dictionary_id,
+        )
+
+    total = 0
+    last_id = 0
+    while True:
+        logs = (
+            await session.scalars(
+                select(Log)
+                .where(condition)
+                .where(Log.id > last_id)
+                .order_by(Log.id)
+                .limit(batch_size)
+            )
+        ).all()
+        if not logs:
+            return total
+
+        await load_log_dictionaries(session, {log.dictionary_id for log in logs})
+
+        for log in logs:
+            log.compressed = compress_text(log.text, dictionary_id)
+            log.dictionary_id = dictionary_id
+            log.plain_text = None
+
+        await session.commit()
+
+        total += len(logs)
+        last_id = logs[-1].id
+        logger.info("Compressed %d logs", total)
+
+
+async def archive_logs(
+    session: AsyncSession, keep: int, batch_size: int, path: Path
+) -> int:
+    # Moves all logs except `keep` latest per (user, chapter, check) to
+    # zstd-compressed JSON lines files, one file per batch
+    ranked = select(
+        Log.id,
+        func.row_number()
+        .over(
+            partition_by=(Log.user_id, Log.chapter, Log.check),
+            order_by=Log.created.desc(),
+        )
+        .label("row"),
+    ).subquery()
+
+    # Only ids are kept in memory, so the window is computed once
+    log_ids = (
+        await session.scalars(
+            select(ranked.c.id).where(ranked.c.row > keep).order_by(ranked.c.id)
+        )
+    ).all()
+
+    path.mkdir(parents=True, exist_ok=True)
+
+    total = 0
+    for start in range(0, len(log_ids), batch_size):
+        batch_ids = log_ids[start : start + batch_size]
+        logs = (
+            await session.scalars(
+                select(Log).where(Log.id.in_(batch_ids)).order_by(Log.id)
+            )
+        ).all()
+        # Rows deleted meanwhile, for example with their user
+        if not logs:
+            continue
+
+        await load_log_dictionaries(session, {log.dictionary_id for log in logs})
+
+        content = "".join(
+            json.dumps(
+                {
+                    "id": log.id,
+                    "created": log.created.isoformat(),
+                    "user_id": log.user_id,
+                    "chapter": log.chapter,
+                    "check": log.check,
+                    "text": log.text,
+                },
+                ensure_ascii=False,
+            )
+            + "\n"
+            for log in logs
+        )
+
+        # Archive is written before rows are deleted, so a failure can only
+        # leave duplicates in the archive
+        archive = path / f"logs-{logs[0].id}-{logs[-1].id}.jsonl.zst"
+        temporary = archive.with_suffix(".tmp")
+        temporary.write_bytes(compress_text(content))
+        temporary.rename(archive)
+
+        await session.execute(delete(Log).where(Log.id.in_(batch_ids)))
+        await session.commit()
+
+        total += len(logs)
+        logger.info("Archived %d of %d logs to %s", total, len(log_ids), archive)
+
+    return total
+
+
+__all__ = [
+    "load_log_dictionaries",
+    "create_log",
+    "train_log_dictionary",
+    "compress_logs",
+    "archive_logs",
+]
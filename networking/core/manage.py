@@ -0,0 +1,509 @@
+import argparse
+import asyncio
+import logging
+from decimal import Decimal
+from pathlib import Path
+from random import Random
+
+from sqlalchemy import DDL, Connection, inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import load_only
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.sql.expression import true
+
+from quirck.auth.model import User
+from quirck.box.docker import lock_meta
+from quirck.box.exception import DockerConflict
+from quirck.box.model import DockerMeta, DockerState
+from quirck.db.base import Base
+
+from networking.chapters import chapters, get_chapter
+from networking.core import log, selfcheck, variant
+from networking.core.chapter.base import BaseChapter
+from networking.core.chapter.check import CheckableMixin
+from networking.core.config import LOG_ARCHIVE_PATH, LOG_RETENTION
+from networking.core.database import create_tables, get_engine, get_sessionmaker
+from networking.core.job import enqueue_job
+from networking.core.model import Attempt, Exam, Job, JobKind, JobState
+from networking.core.score import load_scores, task_score_query
+from networking.core.selfcheck import ScoreKey, ScoreValue
+
+logger = logging.getLogger(__name__)
+
+REGRADE_POLL_INTERVAL = 2
+
+# Correctness and points of the latest attempt of a user's task, None if there
+# is none
+VerdictKey = tuple[int, str]
+Verdict = ScoreValue | None
+
+
+def migrate_columns(connection: Connection) -> None:
+    inspector = inspect(connection)
+    preparer = connection.dialect.identifier_preparer
+
+    for table in Base.metadata.sorted_tables:
+        existing = {
+            column["name"]: column for column in inspector.get_columns(table.name)
+        }
+
+        for column in table.columns:
+            if column.name not in existing:
+                logger.info("Adding column %s.%s", table.name, column.name)
+                definition = CreateColumn(column).compile(dialect=connection.dialect)
+                connection.execute(
+                    DDL(f"ALTER TABLE {preparer.format_table(table)} ADD {definition}")
+                )
+            elif column.nullable and not existing[column.name]["nullable"]:
+                logger.info("Making column %s.%s nullable", table.name, column.name)
+                connection.execute(
+                    DDL(
+                        f"ALTER TABLE {preparer.format_table(table)} "
+                        f"ALTER {preparer.format_column(column)} DROP NOT NULL"
+                    )
+                )
+
+
+async def migrate(args: argparse.Namespace) -> None:
+    # create_all() skips existing tables, so columns and indexes added later
+    # are created here
+    async with get_engine().begin() as connection:
+        await connection.run_sync(migrate_columns)
+
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                logger.info("Creating index %s if it does not exist", index.name)
+                await connection.run_sync(index.create, checkfirst=True)
+
+
+async def rebuild_scores(args: argparse.Namespace) -> None:
+    selected = chapters if args.chapter is None else [get_chapter(args.chapter)]
+
+    async with get_sessionmaker()() as session:
+        for chapter in selected:
+            if chapter is None:
+                raise SystemExit(f"Unknown chapter: {args.chapter}")
+
+            logger.info("Rebuilding scores for %s", chapter.slug)
+            await chapter.rebuild_scores(session)
+
+        await session.commit()
+
+
+async def add_synthetic_attempts(
+    session: AsyncSession, selected: list[BaseChapter]
+) -> None:
+    # selfcheck's attempts, given to existing users as they reference them
+    user_ids = list(
+        await session.scalars(
+            select(User.id).order_by(User.id).limit(selfcheck.USERS)
+        )
+    )
+    rnd = Random("selfcheck")
+    for chapter in selected:
+        attempts = [
+            attempt
+            for attempt in selfcheck.make_attempts(chapter, rnd)
+            if attempt.user_id <= len(user_ids)
+        ]
+        for attempt in attempts:
+            attempt.user_id = user_ids[attempt.user_id - 1]
+
+        await chapter.add_attempts(session, attempts)
+
+    logger.info("Added synthetic attempts for %d users", len(user_ids))
+
+
+async def verify_scores(args: argparse.Namespace) -> None:
+    selected = selfcheck.selfcheck_chapters() if args.synthetic else chapters
+
+    async with get_sessionmaker()() as session:
+        if args.synthetic:
+            await add_synthetic_attempts(session, selected)
+
+        debtors = set(
+            await session.scalars(select(Exam.user_id).where(Exam.has_debt == true()))
+        )
+
+        python_scores: dict[ScoreKey, ScoreValue] = {}
+        batch_scores: dict[ScoreKey, ScoreValue] = {}
+        for chapter in selected:
+            attempts = (
+                await session.scalars(
+                    select(Attempt)
+                    .options(
+                        load_only(
+                            Attempt.user_id,
+                            Attempt.chapter,
+                            Attempt.task,
+                            Attempt.submitted,
+                            Attempt.is_correct,
+                            Attempt.points,
+                        )
+                    )
+                    .where(Attempt.chapter == chapter.slug)
+                    .order_by(Attempt.user_id, Attempt.task)
+                )
+            ).all()
+
+            python_scores.update(selfcheck.python_scores(chapter, attempts, debtors))
+            batch_scores.update(selfcheck.batch_scores(chapter, attempts, debtors))
+
+        sql_scores: dict[ScoreKey, ScoreValue] = {
+            (row.user_id, row.chapter, row.task): (row.is_solved, row.score)
+            for row in await session.execute(task_score_query(selected, with_debt=True))
+        }
+
+        stored_scores: dict[ScoreKey, ScoreValue] = {}
+        for user_id, user_scores in (await load_scores(session)).items():
+            for chapter_scores in user_scores.values():
+                for score in chapter_scores.values():
+                    value = score.score
+                    if user_id in debtors and value is not None:
+                        value *= Decimal("1.5")
+                    stored_scores[user_id, score.chapter, score.task] = (
+                        score.is_solved,
+                        value,
+                    )
+
+        # Synthetic attempts are never committed
+        await session.rollback()
+
+    # Tasks having attempts without any score are the same as tasks without attempts
+    python_scores, batch_scores, sql_scores, stored_scores = (
+        {key: value for key, value in scores.items() if value != (False, None)}
+        for scores in (python_scores, batch_scores, sql_scores, stored_scores)
+    )
+
+    mismatches = 0
+    for source, scores in (
+        ("batch", batch_scores),
+        ("sql", sql_scores),
+        ("stored", stored_scores),
+    ):
+        for key in sorted(python_scores.keys() | scores.keys()):
+            if python_scores.get(key) != scores.get(key):
+                mismatches += 1
+                logger.error(
+                    "Score mismatch for %s: python=%s, %s=%s",
+                    key,
+                    python_scores.get(key),
+                    source,
+                    scores.get(key),
+                )
+
+    if mismatches:
+        raise SystemExit(f"Found {mismatches} mismatching scores")
+
+    logger.info("All %d task scores match", len(python_scores))
+
+
+async def train_log_dictionary(args: argparse.Namespace) -> None:
+    async with get_sessionmaker()() as session:
+        await log.train_log_dictionary(session, args.samples, args.size)
+
+
+async def compress_logs(args: argparse.Namespace) -> None:
+    async with get_sessionmaker()() as session:
+        total = await log.compress_logs(session, args.batch_size, args.recompress)
+
+    logger.info("Done, %d logs compressed", total)
+
+
+async def archive_logs(args: argparse.Namespace) -> None:
+    async with get_sessionmaker()() as session:
+        total = await log.archive_logs(
+            session, args.keep, args.batch_size, Path(args.path)
+        )
+
+    logger.info("Done, %d logs archived", total)
+
+
+async def precompute_variants(args: argparse.Namespace) -> None:
+    selected = chapters if args.chapter is None else [get_chapter(args.chapter)]
+
+    async with get_sessionmaker()() as session:
+        for chapter in selected:
+            if chapter is None:
+                raise SystemExit(f"Unknown chapter: {args.chapter}")
+
+            params = await variant.precompute_variants(
+                session, chapter, args.batch_size
+            )
+
+            for key, shared in sorted(variant.audit_variants(params).items()):
+                if shared:
+                    logger.warning(
+                        "%s: %s is the same for %d of %d users",
+                        chapter.slug,
+                        key,
+                        shared,
+                        len(params),
+                    )
+
+            logger.info(
+                "Done, %d %s variants of version %s",
+                len(params),
+                chapter.slug,
+                chapter.variant_version[:16],
+            )
+
+
+def check_tasks(chapter: CheckableMixin, check: str, user_ids: list[int]) -> list[str]:
+    # Tasks do not depend on the variant, any user having the check will do
+    for user_id in user_ids:
+        variant = chapter.make_variant(user_id)
+        if check in variant.check_names:
+            return variant.checks[check].tasks or [check]
+
+    raise SystemExit(f"No user of {chapter.slug} has check {check}")
+
+
+async def previous_verdicts(
+    chapter: BaseChapter, tasks: list[str], user_ids: list[int]
+) -> dict[VerdictKey, Verdict]:
+    async with get_sessionmaker()() as session:
+        rows = await session.execute(
+            select(Attempt.user_id, Attempt.task, Attempt.is_correct, Attempt.points)
+            .distinct(Attempt.user_id, Attempt.task)
+            .where(Attempt.chapter == chapter.slug)
+            .where(Attempt.task.in_(tasks))
+            .where(Attempt.user_id.in_(user_ids))
+            .order_by(
+                Attempt.user_id,
+                Attempt.task,
+                Attempt.submitted.desc(),
+                Attempt.id.desc(),
+            )
+        )
+
+    return {
+        (user_id, task): (is_correct, points)
+        for user_id, task, is_correct, points in rows
+    }
+
+
+async def job_verdicts(
+    job_ids: set[int], tasks: list[str]
+) -> dict[VerdictKey, Verdict]:
+    # Checks of a user never run at once, so the attempts of a check job are
+    # the ones submitted while it was running
+    async with get_sessionmaker()() as session:
+        rows = await session.execute(
+            select(Job.user_id, Attempt.task, Attempt.is_correct, Attempt.points)
+            .join(
+                Attempt,
+                (Attempt.user_id == Job.user_id)
+                & (Attempt.chapter == Job.chapter)
+                & Attempt.submitted.between(Job.started, Job.finished),
+            )
+            .where(Job.id.in_(job_ids))
+            .where(Attempt.task.in_(tasks))
+            .order_by(Attempt.submitted, Attempt.id)
+        )
+
+    return {
+        (user_id, task): (is_correct, points)
+        for user_id, task, is_correct, points in rows
+    }
+
+
+async def regrade(args: argparse.Namespace) -> None:
+    chapter = get_chapter(args.chapter)
+    if not isinstance(chapter, CheckableMixin):
+        raise SystemExit(f"Chapter {args.chapter} has no checks")
+
+    async with get_sessionmaker()() as session:
+        user_ids = list(
+            await session.scalars(
+                select(DockerMeta.user_id)
+                .where(DockerMeta.chapter == chapter.slug)
+                .where(DockerMeta.state == DockerState.READY)
+                .order_by(DockerMeta.user_id)
+            )
+        )
+
+    tasks = check_tasks(chapter, args.check, user_ids) if user_ids else [args.check]
+    before = await previous_verdicts(chapter, tasks, user_ids)
+
+    # User of every queued job, and of every job that finished successfully
+    jobs: dict[int, int] = {}
+    done: dict[int, int] = {}
+    pending: set[int] = set()
+    finished: dict[JobState, int] = {JobState.DONE: 0, JobState.FAILED: 0}
+    queued = skipped = 0
+
+    async def refresh() -> None:
+        async with get_sessionmaker()() as session:
+            states = await session.execute(
+                select(Job.id, Job.state).where(Job.id.in_(pending))
+            )
+            for job_id, state in states:
+                if state in finished:
+                    finished[state] += 1
+                    pending.discard(job_id)
+                    if state == JobState.DONE:
+                        done[job_id] = jobs[job_id]
+
+        logger.info(
+            "Regrade: %d of %d queued, %d done, %d failed, %d skipped",
+            queued,
+            len(user_ids),
+            finished[JobState.DONE],
+            finished[JobState.FAILED],
+            skipped,
+        )
+
+    for user_id in user_ids:
+        while len(pending) >= args.concurrency:
+            await asyncio.sleep(REGRADE_POLL_INTERVAL)
+            await refresh()
+
+        if args.check not in chapter.make_variant(user_id).check_names:
+            skipped += 1
+            continue
+
+        async with get_sessionmaker()() as session:
+            try:
+                meta = await lock_meta(session, user_id, chapter.slug, True)
+            except DockerConflict:
+                # The user is launching or checking something right now
+                skipped += 1
+                continue
+
+            job = await enqueue_job(
+                session, JobKind.CHECK, meta.user_id, chapter.slug, args.check
+            )
+            await session.commit()
+
+        jobs[job.id] = user_id
+        pending.add(job.id)
+        queued += 1
+
+        if args.rate:
+            await asyncio.sleep(1 / args.rate)
+
+    while pending:
+        await asyncio.sleep(REGRADE_POLL_INTERVAL)
+        await refresh()
+
+    # Failed jobs have no verdict to compare
+    after = await job_verdicts(set(done), tasks)
+
+    changes = 0
+    for key in sorted(
+        (user_id, task) for user_id in set(done.values()) for task in tasks
+    ):
+        if before.get(key) != after.get(key):
+            changes += 1
+            logger.info(
+                "Changed verdict of user %d in %s: %s -> %s",
+                *key,
+                before.get(key),
+                after.get(key),
+            )
+
+    logger.info(
+        "Done, %d checks run, %d failed, %d users skipped, %d verdicts changed",
+        finished[JobState.DONE],
+        finished[JobState.FAILED],
+        skipped,
+        changes,
+    )
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m networking.core.manage")
+    commands = parser.add_subparsers(required=True)
+
+    command = commands.add_parser(
+        "migrate", help="update schema of existing tables"
+    )
+    command.set_defaults(handler=migrate)
+
+    command = commands.add_parser(
+        "rebuild-scores", help="recompute best-score table from attempts"
+    )
+    command.add_argument("--chapter", help="only rebuild the given chapter")
+    command.set_defaults(handler=rebuild_scores)
+
+    command = commands.add_parser(
+        "verify-scores",
+        help="check that batch, SQL and stored scores match the Python implementation",
+    )
+    command.add_argument(
+        "--synthetic",
+        action="store_true",
+        help="add selfcheck's attempts in a transaction that is rolled back",
+    )
+    command.set_defaults(handler=verify_scores)
+
+    command = commands.add_parser(
+        "train-log-dictionary",
+        help="train a new compression dictionary on the latest check logs",
+    )
+    command.add_argument("--samples", type=int, default=5000)
+    command.add_argument("--size", type=int, default=112640, help="in bytes")
+    command.set_defaults(handler=train_log_dictionary)
+
+    command = commands.add_parser(
+        "compress-logs", help="compress logs stored as plain text"
+    )
+    command.add_argument("--batch-size", type=int, default=1000)
+    command.add_argument(
+        "--recompress",
+        action="store_true",
+        help="also recompress logs using older dictionaries",
+    )
+    command.set_defaults(handler=compress_logs)
+
+    command = commands.add_parser(
+        "archive-logs",
+        help="move all but the latest check logs to archive files",
+    )
+    command.add_argument(
+        "--keep",
+        type=int,
+        default=LOG_RETENTION,
+        help="logs to keep for every user, chapter and check",
+    )
+    command.add_argument("--batch-size", type=int, default=1000)
+    command.add_argument("--path", default=LOG_ARCHIVE_PATH)
+    command.set_defaults(handler=archive_logs)
+
+    command = commands.add_parser(
+        "precompute-variants",
+        help="store every user's variants and report values shared between users",
+    )
+    command.add_argument("--chapter", help="only precompute the given chapter")
+    command.add_argument("--batch-size", type=int, default=1000)
+    command.set_defaults(handler=precompute_variants)
+
+    command = commands.add_parser(
+        "regrade",
+        help="re-run a check for every user with a running deployment",
+    )
+    command.add_argument("--chapter", required=True)
+    command.add_argument("--check", required=True)
+    command.add_argument(
+        "--concurrency", type=int, default=8, help="jobs queued or running at once"
+    )
+    command.add_argument(
+        "--rate", type=float, default=None, help="jobs queued per second"
+    )
+    command.set_defaults(handler=regrade)
+
+    return parser
+
+
+async def run(args: argparse.Namespace) -> None:
+    await create_tables()
+    await args.handler(args)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run(build_parser().parse_args()))
+
+
+__all__ = ["build_parser"]
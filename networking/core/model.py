@@ -1,3 +1,4 @@
+import enum
 from datetime import datetime
 from decimal import Decimal
 from typing import Any
@@ -7,6 +8,10 @@ from sqlalchemy import (
     BigInteger,
     Boolean,
     DateTime,
+    Enum,
+    Index,
+    Integer,
+    LargeBinary,
     Numeric,
     String,
     Text,
@@ -18,6 +23,8 @@ from sqlalchemy.orm import Mapped, mapped_column, relationship
 from quirck.auth.model import User
 from quirck.db.base import Base
 
+from networking.core.compression import decompress_text
+
 
 class Attempt(Base):
     __tablename__ = "attempt"
@@ -40,6 +47,33 @@ class Attempt(Base):
 
     user: Mapped[User] = relationship("User", back_populates="attempts")
 
+    # `submitted` is needed right after flush to apply deadlines to the score table
+    __mapper_args__ = {"eager_defaults": True}
+
+
+class TaskScore(Base):
+    __tablename__ = "task_score"
+
+    user_id: Mapped[int] = mapped_column(
+        BigInteger,
+        ForeignKey("user.id", onupdate="CASCADE", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    chapter: Mapped[str] = mapped_column(String(32), primary_key=True)
+    task: Mapped[str] = mapped_column(String(32), primary_key=True)
+
+    is_solved: Mapped[bool] = mapped_column(Boolean, nullable=False)
+    # Best score with deadline rules applied, but without debt factor
+    score: Mapped[Decimal | None] = mapped_column(Numeric, nullable=True)
+
+
+class ScoreVersion(Base):
+    __tablename__ = "score_version"
+
+    # Single row, bumped in the same transaction as any task_score change
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    version: Mapped[int] = mapped_column(BigInteger, nullable=False)
+
 
 class Report(Base):
     __tablename__ = "report"
@@ -73,10 +107,118 @@ class Log(Base):
     )
     chapter: Mapped[str] = mapped_column(String(32), nullable=False)
     check: Mapped[str] = mapped_column(String(32), nullable=False)
-    text: Mapped[str] = mapped_column(Text, nullable=False)
+    # Logs written before compression, converted by `manage compress-logs`
+    plain_text: Mapped[str | None] = mapped_column("text", Text, nullable=True)
+    compressed: Mapped[bytes | None] = mapped_column(LargeBinary, nullable=True)
+    dictionary_id: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
+    # Seconds spent in each phase of the check
+    timings: Mapped[dict[str, float] | None] = mapped_column(JSONB, nullable=True)
 
     user: Mapped[User] = relationship("User", back_populates="logs")
 
+    @property
+    def text(self) -> str:
+        # Dictionary must be loaded with load_log_dictionaries() beforehand
+        if self.compressed is not None:
+            return decompress_text(self.compressed, self.dictionary_id)
+        return self.plain_text or ""
+
+
+# Latest log of a check is a single index lookup
+Index("ix_log_latest", Log.user_id, Log.chapter, Log.check, Log.created.desc())
+
+
+class LogDictionary(Base):
+    __tablename__ = "log_dictionary"
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    created: Mapped[datetime] = mapped_column(
+        DateTime, server_default=text("now()"), nullable=False
+    )
+    data: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+
+
+class JobKind(enum.Enum):
+    LAUNCH = "launch"
+    STOP = "stop"
+    CHECK = "check"
+
+
+class JobState(enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class Job(Base):
+    __tablename__ = "job"
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    created: Mapped[datetime] = mapped_column(
+        DateTime, server_default=text("now()"), nullable=False
+    )
+    kind: Mapped[JobKind] = mapped_column(Enum(JobKind), nullable=False)
+    user_id: Mapped[int] = mapped_column(
+        BigInteger,
+        ForeignKey("user.id", onupdate="CASCADE", ondelete="CASCADE"),
+        nullable=False,
+    )
+    chapter: Mapped[str] = mapped_column(String(32), nullable=False)
+    check: Mapped[str | None] = mapped_column(String(32), nullable=True)
+    # Queued while the same check was running, takes the lock itself
+    follow_up: Mapped[bool] = mapped_column(
+        Boolean, server_default=text("false"), nullable=False
+    )
+
+    state: Mapped[JobState] = mapped_column(
+        Enum(JobState), default=JobState.QUEUED, nullable=False
+    )
+    tries: Mapped[int] = mapped_column(
+        Integer, server_default=text("0"), nullable=False
+    )
+    # Queued jobs are not claimed before this moment
+    not_before: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    started: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    # Updated by the worker while the job runs, stale jobs are picked up again
+    heartbeat: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    finished: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    # Seconds spent in each phase, from the request to the end of the job
+    timings: Mapped[dict[str, float] | None] = mapped_column(JSONB, nullable=True)
+
+
+Index("ix_job_state", Job.state, Job.created)
+# Latest job of a user's chapter, looked up by every open chapter page
+Index("ix_job_user_chapter", Job.user_id, Job.chapter, Job.id)
+# At most one queued run of a check, duplicate requests attach to it
+Index(
+    "ix_job_queued_check",
+    Job.user_id,
+    Job.chapter,
+    Job.check,
+    unique=True,
+    postgresql_where=(Job.kind == JobKind.CHECK) & (Job.state == JobState.QUEUED),
+)
+
+
+class VariantSnapshot(Base):
+    __tablename__ = "variant_snapshot"
+
+    user_id: Mapped[int] = mapped_column(
+        BigInteger,
+        ForeignKey("user.id", onupdate="CASCADE", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    chapter: Mapped[str] = mapped_column(String(32), primary_key=True)
+    # Snapshots of another seed or generator code are ignored
+    version: Mapped[str] = mapped_column(String(64), nullable=False)
+    created: Mapped[datetime] = mapped_column(
+        DateTime, server_default=text("now()"), nullable=False
+    )
+    # Values drawn by the variant generator, see BaseChapter.generate_params
+    params: Mapped[dict[str, Any]] = mapped_column(JSONB, nullable=False)
+
 
 class Exam(Base):
     __tablename__ = "exam"
@@ -114,4 +256,12 @@ User.logs = relationship("Log", back_populates="user")
 User.exam = relationship("Exam", back_populates="user", uselist=False)
 
 
-__all__ = ["Attempt"]
+__all__ = [
+    "Attempt",
+    "Job",
+    "JobKind",
+    "JobState",
+    "TaskScore",
+    "ScoreVersion",
+    "VariantSnapshot",
+]
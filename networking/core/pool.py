@@ -0,0 +1,327 @@
+import asyncio
+import contextlib
+import io
+import logging
+import shlex
+import tarfile
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, AsyncIterator
+
+import aiodocker
+import aiohttp
+from aiodocker.containers import DockerContainer
+from aiodocker.exceptions import DockerError
+from aiodocker.networks import DockerNetwork
+from netaddr import EUI, mac_unix_expanded
+
+from quirck.box.docker import run_container
+from quirck.box.meta import ContainerMeta
+from quirck.box.model import DockerMeta
+
+from networking.core.config import CHECK_POOL, DOCKER_CONNECTIONS, DOCKER_HOST
+
+logger = logging.getLogger(__name__)
+
+POOL_LABEL = "networking.pool"
+ENV_PATH = "run/box.env"
+EVICT_INTERVAL = 60
+
+# Parts of a container config that do not depend on the user
+TEMPLATE_FIELDS = ["Image", "Cmd", "Entrypoint", "WorkingDir", "User"]
+
+
+@dataclass
+class PoolSpec:
+    size: int
+    max_idle: float
+
+
+def parse_pool_specs(value: str) -> dict[str, PoolSpec]:
+    # image=size[:max_idle],...
+    specs = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        image, _, limits = item.partition("=")
+        size, _, max_idle = limits.partition(":")
+        specs[image] = PoolSpec(int(size), float(max_idle or 3600))
+
+    return specs
+
+
+def pool_key(container: ContainerMeta) -> str:
+    # Everything that cannot be changed after the container is created
+    return repr(
+        (
+            container.image,
+            sorted((container.volumes or {}).items()),
+            container.ipv6_forwarding,
+            container.mem_limit,
+        )
+    )
+
+
+def env_archive(environment: dict[str, str]) -> bytes:
+    content = "".join(
+        f"export {name}={shlex.quote(str(value))}\n"
+        for name, value in environment.items()
+    ).encode()
+
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        info = tarfile.TarInfo(ENV_PATH)
+        info.size = len(content)
+        info.mode = 0o644
+        tar.addfile(info, io.BytesIO(content))
+
+    return buffer.getvalue()
+
+
+def create_client() -> aiodocker.Docker:
+    if DOCKER_HOST.startswith("unix://"):
+        connector = aiohttp.UnixConnector(
+            DOCKER_HOST.removeprefix("unix://"), limit=DOCKER_CONNECTIONS
+        )
+        # Host name is only used to compose URLs
+        return aiodocker.Docker(url="unix://localhost", connector=connector)
+
+    return aiodocker.Docker(url=DOCKER_HOST)
+
+
+def format_mac(mac: str) -> str:
+    return str(EUI(mac, dialect=mac_unix_expanded))
+
+
+class WarmPool:
+    # Stopped checker containers, created ahead of time. Their config is copied
+    # from a container started by quirck for the same image, and network names
+    # are remembered from the user's cold checks. Until then checks start cold.
+
+    def __init__(self, specs: dict[str, PoolSpec]):
+        self.specs = specs
+        # The worker's only client, checks use it as well
+        self.docker = create_client()
+        self.templates: dict[str, dict[str, Any]] = {}
+        self.idle: dict[str, deque[tuple[str, float]]] = {}
+        self.networks: dict[tuple[int, str], str] = {}
+        self.filling: dict[str, asyncio.Task[None]] = {}
+
+    async def start(
+        self, meta: DockerMeta, container: ContainerMeta
+    ) -> DockerContainer:
+        if container.image not in self.specs:
+            return await run_container(meta, container)
+
+        key = pool_key(container)
+        try:
+            claimed = await self.claim(meta, container, key)
+        except DockerError:
+            logger.warning("Cannot start pooled %s, starting cold", container.image)
+            claimed = None
+
+        if claimed is not None:
+            return claimed
+
+        started = await run_container(meta, container)
+        await self.learn(meta, container, key, started.id)
+        return started
+
+    async def claim(
+        self, meta: DockerMeta, container: ContainerMeta, key: str
+    ) -> DockerContainer | None:
+        names = [
+            self.networks.get((meta.user_id, network.network_name))
+            for network in container.networks
+        ]
+        if None in names:
+            return None
+
+        idle = self.idle.get(key)
+        if not idle:
+            self.fill(key)
+            return None
+
+        container_id, _ = idle.popleft()
+        self.fill(key)
+
+        claimed = self.docker.containers.container(container_id)
+        try:
+            await DockerNetwork(self.docker, "bridge").disconnect(
+                {"Container": container_id, "Force": True}
+            )
+            for name, network in zip(names, container.networks):
+                endpoint = (
+                    {}
+                    if network.mac_address is None
+                    else {"MacAddress": format_mac(network.mac_address)}
+                )
+                await DockerNetwork(self.docker, name).connect(
+                    {"Container": container_id, "EndpointConfig": endpoint}
+                )
+
+            await claimed.put_archive("/", env_archive(container.environment or {}))
+            await claimed.start()
+        except DockerError:
+            await self.remove(container_id)
+            # The deployment was probably relaunched with new networks
+            for network in container.networks:
+                self.networks.pop((meta.user_id, network.network_name), None)
+            raise
+
+        return claimed
+
+    async def remove(self, container_id: str) -> None:
+        try:
+            await self.docker.containers.container(container_id).delete(force=True)
+        except DockerError:
+            logger.warning("Cannot remove pooled container %s", container_id)
+
+    async def learn(
+        self, meta: DockerMeta, container: ContainerMeta, key: str, container_id: str
+    ) -> None:
+        try:
+            info = await self.docker.containers.container(container_id).show()
+        except DockerError:
+            return
+
+        attached: dict[str, Any] = info["NetworkSettings"]["Networks"]
+        if len(container.networks) == 1 and len(attached) == 1:
+            self.networks[(meta.user_id, container.networks[0].network_name)] = next(
+                iter(attached)
+            )
+        else:
+            for name, endpoint in attached.items():
+                for network in container.networks:
+                    if (
+                        network.mac_address is not None
+                        and endpoint.get("MacAddress")
+                        and EUI(endpoint["MacAddress"]) == EUI(network.mac_address)
+                    ):
+                        self.networks[(meta.user_id, network.network_name)] = name
+
+        if key not in self.templates:
+            # Environment and labels of the container may be the user's, warm
+            # containers only get the image's ones and run/box.env
+            try:
+                image = await self.docker.images.inspect(info["Image"])
+            except DockerError:
+                return
+
+            self.templates[key] = {
+                **{
+                    field: info["Config"][field]
+                    for field in TEMPLATE_FIELDS
+                    if info["Config"].get(field) is not None
+                },
+                "Env": image["Config"].get("Env") or [],
+                "HostConfig": {**info["HostConfig"], "NetworkMode": "bridge"},
+                "Labels": {POOL_LABEL: key},
+            }
+            self.fill(key)
+
+    def fill(self, key: str) -> None:
+        if key in self.templates and key not in self.filling:
+            task = asyncio.create_task(self.refill(key))
+            self.filling[key] = task
+            task.add_done_callback(lambda _: self.filling.pop(key, None))
+
+    async def refill(self, key: str) -> None:
+        template = self.templates[key]
+        spec = self.specs[template["Image"]]
+        idle = self.idle.setdefault(key, deque())
+
+        while len(idle) < spec.size:
+            try:
+                created = await self.docker.containers.create(template)
+            except DockerError:
+                logger.exception("Cannot create pooled %s", template["Image"])
+                return
+
+            idle.append((created.id, time.monotonic()))
+
+    async def evict(self) -> None:
+        # Old containers are replaced, so that rebuilt images are picked up
+        now = time.monotonic()
+        for key, idle in self.idle.items():
+            spec = self.specs[self.templates[key]["Image"]]
+            while idle and now - idle[0][1] > spec.max_idle:
+                container_id, _ = idle.popleft()
+                await self.remove(container_id)
+
+            self.fill(key)
+
+    async def remove_orphans(self) -> None:
+        # Containers of crashed workers, any live worker evicts them earlier
+        deadline = time.time() - max(
+            (spec.max_idle for spec in self.specs.values()), default=0
+        )
+        deadline -= 2 * EVICT_INTERVAL
+
+        leftover = await self.docker.containers.list(
+            all=True, filters={"label": [POOL_LABEL]}
+        )
+        await asyncio.gather(
+            *[
+                self.remove(item.id)
+                for item in leftover
+                if item["Created"] < deadline
+            ]
+        )
+
+    async def maintain(self) -> None:
+        while True:
+            try:
+                await self.remove_orphans()
+                await self.evict()
+            except Exception:
+                logger.exception("Cannot maintain the warm pool")
+
+            await asyncio.sleep(EVICT_INTERVAL)
+
+    async def close(self) -> None:
+        for task in list(self.filling.values()):
+            task.cancel()
+
+        await asyncio.gather(
+            *[
+                self.remove(container_id)
+                for idle in self.idle.values()
+                for container_id, _ in idle
+            ]
+        )
+        self.idle.clear()
+        await self.docker.close()
+
+
+pool: WarmPool | None = None
+
+
+@contextlib.asynccontextmanager
+async def pool_lifespan() -> AsyncIterator[WarmPool]:
+    global pool
+
+    pool = WarmPool(parse_pool_specs(CHECK_POOL))
+    maintenance = asyncio.create_task(pool.maintain())
+    try:
+        yield pool
+    finally:
+        maintenance.cancel()
+        await pool.close()
+        pool = None
+
+
+async def start_container(
+    meta: DockerMeta, container: ContainerMeta
+) -> DockerContainer:
+    if pool is None:
+        return await run_container(meta, container)
+    return await pool.start(meta, container)
+
+
+def get_docker() -> aiodocker.Docker:
+    if pool is None:
+        raise RuntimeError("Warm pool is not started")
+    return pool.docker
+
+
+__all__ = ["get_docker", "pool_lifespan", "start_container"]
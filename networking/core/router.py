@@ -1,16 +1,16 @@
-import itertools
+import asyncio
+import time
 from dataclasses import dataclass
 from decimal import Decimal
 from hashlib import sha256
 
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import joinedload
 from starlette.exceptions import HTTPException
 from starlette.middleware import Middleware
 from starlette.requests import Request
 from starlette.responses import RedirectResponse, PlainTextResponse, Response
-from starlette.routing import Mount, Route
+from starlette.routing import BaseRoute, Mount, Route
 
 from quirck.auth.middleware import AuthenticationMiddleware
 from quirck.auth.model import User
@@ -19,28 +19,29 @@ from quirck.web.template import TemplateResponse
 
 from networking.chapters import chapters
 from networking.core.chapter.base import ChapterResult
+from networking.core.export import get_export_mount
 from networking.core.middleware import LoadMetaMiddleware
-from networking.core.model import Attempt, Exam
-from networking.core.config import SECRET_SEED, SCOREBOARD_TOKEN
+from networking.core.model import Exam
+from networking.core.score import get_score_version, load_scores
+from networking.core.timing import timings_page
+from networking.core.config import (
+    SECRET_SEED,
+    SCOREBOARD_CACHE_TTL,
+    SCOREBOARD_TOKEN,
+)
 
 
 async def main_page(request: Request) -> Response:
     user: User = request.scope["user"]
     session: AsyncSession = request.scope["db"]
 
-    attempts = (
-        await session.scalars(
-            select(Attempt)
-            .where(Attempt.user_id == user.id)
-            .order_by(Attempt.chapter, Attempt.task, Attempt.submitted.desc())
-        )
-    ).all()
+    scores = (await load_scores(session, user.id)).get(user.id, {})
 
     exam: Exam | None = user.exam
 
     user_chapters = [
-        chapter.calculate_score(
-            [attempt for attempt in attempts if attempt.chapter == chapter.slug],
+        chapter.calculate_stored_score(
+            scores.get(chapter.slug, {}),
             False if exam is None else exam.has_debt,
         )
         for chapter in chapters
@@ -74,14 +75,114 @@ async def main_page(request: Request) -> Response:
 
 @dataclass
 class UserScore:
-    user: User
+    # Detached from the session, so that it can outlive the request in the cache
+    id: int
+    name: str
     chapters: list[ChapterResult]
+    points: Decimal
+    has_debt: bool = False
+    test_points: Decimal | None = None
+    final_points: Decimal | None = None
 
     @property
     def score(self) -> Decimal:
         return sum((chapter.score for chapter in self.chapters), Decimal(0))
 
 
+@dataclass
+class Scoreboard:
+    version: int
+    created: float
+    etag: str
+    users: list[UserScore]
+
+
+scoreboard_cache: Scoreboard | None = None
+scoreboard_lock = asyncio.Lock()
+
+
+async def build_scoreboard(session: AsyncSession, version: int) -> Scoreboard:
+    users = (
+        await session.execute(
+            select(User.id, User.name, Exam)
+            .outerjoin(Exam, Exam.user_id == User.id)
+            .order_by(User.id)
+        )
+    ).all()
+
+    scores = await load_scores(session)
+
+    user_scores = []
+    for user_id, name, exam in users:
+        user_chapters = [
+            chapter.calculate_stored_score(
+                scores.get(user_id, {}).get(chapter.slug, {}),
+                False if exam is None else exam.has_debt,
+            )
+            for chapter in chapters
+        ]
+        chapter_score = sum((chapter.score for chapter in user_chapters), Decimal(0))
+
+        user_scores.append(
+            UserScore(
+                id=user_id,
+                name=name,
+                chapters=user_chapters,
+                points=(
+                    chapter_score
+                    if exam is None
+                    else exam.calculate_points(chapter_score)
+                ),
+                has_debt=exam is not None and exam.has_debt,
+                test_points=None if exam is None else exam.test_points,
+                final_points=None if exam is None else exam.final_points,
+            )
+        )
+
+    fingerprint = repr(
+        [
+            (
+                user.id,
+                user.name,
+                user.points,
+                user.has_debt,
+                user.test_points,
+                user.final_points,
+                [
+                    (result.is_solved, result.score)
+                    for chapter in user.chapters
+                    for result in chapter.results
+                ],
+            )
+            for user in user_scores
+        ]
+    )
+
+    return Scoreboard(
+        version=version,
+        created=time.monotonic(),
+        etag=f'"{sha256(fingerprint.encode("utf-8")).hexdigest()[:32]}"',
+        users=user_scores,
+    )
+
+
+async def get_scoreboard(session: AsyncSession) -> Scoreboard:
+    global scoreboard_cache
+
+    # Exams and users are not versioned, so the cache is also limited by time
+    version = await get_score_version(session)
+
+    async with scoreboard_lock:
+        if (
+            scoreboard_cache is None
+            or scoreboard_cache.version != version
+            or time.monotonic() - scoreboard_cache.created > SCOREBOARD_CACHE_TTL
+        ):
+            scoreboard_cache = await build_scoreboard(session, version)
+
+        return scoreboard_cache
+
+
 async def scoreboard_guest(request: Request) -> Response:
     if SCOREBOARD_TOKEN is None or request.query_params.get("token") != str(
         SCOREBOARD_TOKEN
@@ -102,55 +203,18 @@ async def scoreboard_admin(request: Request) -> Response:
 async def scoreboard(request: Request) -> Response:
     session: AsyncSession = request.scope["db"]
 
-    users = (
-        await session.scalars(
-            select(User)
-            .order_by(User.id)
-            .options(
-                joinedload(
-                    User.exam  # type: ignore
-                )
-            )
-        )
-    ).all()
+    board = await get_scoreboard(session)
+    headers = {"ETag": board.etag, "Cache-Control": "no-cache"}
 
-    attempts = (
-        await session.scalars(
-            select(Attempt).order_by(
-                Attempt.user_id, Attempt.chapter, Attempt.task, Attempt.submitted.desc()
-            )
-        )
-    ).all()
+    if request.headers.get("if-none-match") == board.etag:
+        return Response(status_code=304, headers=headers)
 
-    grouped_attempts = {
-        user_id: {
-            chapter: list(chapter_attempts)
-            for chapter, chapter_attempts in itertools.groupby(
-                user_attempts, key=lambda attempt: attempt.chapter
-            )
-        }
-        for user_id, user_attempts in itertools.groupby(
-            attempts, key=lambda attempt: attempt.user_id
-        )
-    }
-
-    users_with_chapters = [
-        UserScore(
-            user,
-            [
-                chapter.calculate_score(
-                    grouped_attempts.get(user.id, {}).get(chapter.slug, []),
-                    False if user.exam is None else user.exam.has_debt,
-                )
-                for chapter in chapters
-            ],
-        )
-        for user in users
-    ]
-
-    return TemplateResponse(
-        request, "scoreboard.html", {"chapters": chapters, "users": users_with_chapters}
+    response = TemplateResponse(
+        request, "scoreboard.html", {"chapters": chapters, "users": board.users}
     )
+    response.headers.update(headers)
+
+    return response
 
 
 # TODO: common route for pages
@@ -181,6 +245,8 @@ def get_user_mount():
         routes=[
             Route("/", main_page, name="main"),
             Route("/scoreboard", scoreboard_admin, name="scoreboard"),
+            Route("/timings", timings_page, name="timings"),
+            get_export_mount(),
             Mount(
                 "/vpn",
                 routes=[
@@ -200,6 +266,21 @@ def get_user_mount():
     )
 
 
+def get_stream_routes() -> list[BaseRoute]:
+    # Event streams outlive their request, so LoadMetaMiddleware is skipped: its
+    # refresh would hold the request session's connection for the whole stream
+    return [
+        Route(
+            f"/{chapter.slug}{route.path}",
+            route.endpoint,
+            name=f"networking:{chapter.slug}:{route.name}",
+            middleware=[Middleware(AuthenticationMiddleware)],
+        )
+        for chapter in chapters
+        for route in chapter.stream_routes
+    ]
+
+
 def api_signature(request: Request) -> Response:
     if "message" in request.query_params and "key" in request.query_params:
         message = request.query_params["message"]
@@ -218,6 +299,7 @@ def get_mount():
         routes=[
             Route("/scoreboard/guest", scoreboard_guest, name="scoreboard_guest"),
             Route("/api/signature", api_signature, name="signature"),
+            *get_stream_routes(),
             get_user_mount(),
         ],
     )
@@ -0,0 +1,104 @@
+from decimal import Decimal
+from typing import TYPE_CHECKING, Sequence
+
+from sqlalchemy import Select, and_, case, func, or_, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from networking.core.model import Attempt, Exam, ScoreVersion, TaskScore
+
+if TYPE_CHECKING:
+    from networking.core.chapter.base import BaseChapter
+
+
+def task_score_query(
+    chapters: Sequence[type["BaseChapter"] | "BaseChapter"],
+    user_id: int | None = None,
+    with_debt: bool = False,
+) -> Select:
+    # SQL counterpart of BaseChapter.calculate_task_score for all users at once.
+    # Like the task_score table, scores are stored without debt factor by default.
+    attempt_score = case(
+        *(
+            (Attempt.chapter == chapter.slug, chapter.attempt_score_clause())
+            for chapter in chapters
+        )
+    )
+    score = func.max(attempt_score)
+
+    query = select(
+        Attempt.user_id,
+        Attempt.chapter,
+        Attempt.task,
+        func.bool_or(Attempt.is_correct).label("is_solved"),
+    )
+
+    if with_debt:
+        query = query.add_columns(
+            case(
+                (func.bool_or(Exam.has_debt), score * Decimal("1.5")), else_=score
+            ).label("score")
+        ).outerjoin(Exam, Exam.user_id == Attempt.user_id)
+    else:
+        query = query.add_columns(score.label("score"))
+
+    query = query.where(
+        or_(
+            *(
+                and_(
+                    Attempt.chapter == chapter.slug,
+                    Attempt.task.in_([task.slug for task in chapter.tasks]),
+                )
+                for chapter in chapters
+            )
+        )
+    ).group_by(Attempt.user_id, Attempt.chapter, Attempt.task)
+
+    if user_id is not None:
+        query = query.where(Attempt.user_id == user_id)
+
+    return query
+
+
+async def load_scores(
+    session: AsyncSession, user_id: int | None = None
+) -> dict[int, dict[str, dict[str, TaskScore]]]:
+    query = select(TaskScore)
+    if user_id is not None:
+        query = query.where(TaskScore.user_id == user_id)
+
+    scores: dict[int, dict[str, dict[str, TaskScore]]] = {}
+    for score in await session.scalars(query):
+        scores.setdefault(score.user_id, {}).setdefault(score.chapter, {})[
+            score.task
+        ] = score
+
+    return scores
+
+
+async def bump_score_version(session: AsyncSession) -> None:
+    # Writers wait for each other on this row, so callers take it last, right
+    # before the commit
+    statement = insert(ScoreVersion).values(id=1, version=1)
+    await session.execute(
+        statement.on_conflict_do_update(
+            index_elements=[ScoreVersion.id],
+            set_={"version": ScoreVersion.version + 1},
+        )
+    )
+
+
+async def get_score_version(session: AsyncSession) -> int:
+    # A primary key lookup, it runs on every scoreboard poll
+    version = await session.scalar(
+        select(ScoreVersion.version).where(ScoreVersion.id == 1)
+    )
+    return version or 0
+
+
+__all__ = [
+    "task_score_query",
+    "load_scores",
+    "bump_score_version",
+    "get_score_version",
+]
@@ -0,0 +1,175 @@
+import itertools
+import logging
+from datetime import datetime, timedelta
+from decimal import Decimal
+from random import Random
+from typing import Sequence
+
+import numpy as np
+from sqlalchemy.dialects import postgresql
+
+from networking.chapters import chapters
+from networking.core import golden
+from networking.core.chapter.base import AttemptColumns, BaseChapter, ChapterTask
+from networking.core.model import Attempt
+from networking.core.score import task_score_query
+
+logger = logging.getLogger(__name__)
+
+# Checks needing neither the database nor Docker, run before every start:
+# python -m networking.core.selfcheck
+# Replaces the configuration with the golden one, never import it from the app
+
+ScoreKey = tuple[int, str, str]
+ScoreValue = tuple[bool, Decimal | None]
+
+USERS = 300
+MAX_ATTEMPTS = 6
+POINTS = [None, None, Decimal("0"), Decimal("0.29"), Decimal("0.5"), Decimal("2.75")]
+
+
+class HardDeadlineChapter(BaseChapter[None]):
+    slug = "selfcheck-hard"
+    deadline = datetime(2026, 3, 1, 21, 0, 0)
+    hard_deadline = True
+    tasks = [
+        ChapterTask("first", "Первое", Decimal(1)),
+        ChapterTask("second", "Второе", Decimal("0.33")),
+    ]
+
+
+class NoDeadlineChapter(BaseChapter[None]):
+    slug = "selfcheck-open"
+    deadline = None
+    tasks = [ChapterTask("only", "Единственное", Decimal("1.5"))]
+
+
+class NoTasksChapter(BaseChapter[None]):
+    slug = "selfcheck-empty"
+    deadline = None
+    tasks = []
+
+
+def python_scores(
+    chapter: BaseChapter, attempts: Sequence[Attempt], debtors: set[int]
+) -> dict[ScoreKey, ScoreValue]:
+    # Attempts must be ordered by user and task
+    scores: dict[ScoreKey, ScoreValue] = {}
+    for (user_id, task_slug), task_attempts in itertools.groupby(
+        attempts, key=lambda attempt: (attempt.user_id, attempt.task)
+    ):
+        task = chapter.get_task(task_slug)
+        if task is None:
+            continue
+
+        result = chapter.calculate_task_score(
+            task, list(task_attempts), user_id in debtors
+        )
+        scores[user_id, chapter.slug, task.slug] = (result.is_solved, result.score)
+
+    return scores
+
+
+def batch_scores(
+    chapter: BaseChapter, attempts: Sequence[Attempt], debtors: set[int]
+) -> dict[ScoreKey, ScoreValue]:
+    user_ids = sorted({attempt.user_id for attempt in attempts})
+    results = chapter.calculate_batch_score(
+        AttemptColumns.from_attempts(
+            chapter,
+            attempts,
+            {user_id: index for index, user_id in enumerate(user_ids)},
+        ),
+        np.array([user_id in debtors for user_id in user_ids], dtype=np.bool_),
+    )
+
+    return {
+        (user_id, chapter.slug, result.task.slug): (result.is_solved, result.score)
+        for user_id, chapter_result in zip(user_ids, results)
+        for result in chapter_result.results
+    }
+
+
+def make_attempts(chapter: BaseChapter, rnd: Random) -> list[Attempt]:
+    # Around the deadline, exactly on it included
+    deadline = chapter.deadline or datetime(2026, 3, 1)
+
+    attempts = [
+        Attempt(
+            user_id=user_id,
+            chapter=chapter.slug,
+            task=rnd.choice(chapter.tasks).slug,
+            submitted=deadline + timedelta(hours=rnd.randint(-2, 2)),
+            is_correct=rnd.random() < 0.5,
+            points=rnd.choice(POINTS),
+        )
+        for user_id in range(1, USERS + 1)
+        if chapter.tasks
+        for _ in range(rnd.randint(0, MAX_ATTEMPTS))
+    ]
+    attempts.sort(key=lambda attempt: (attempt.user_id, attempt.task))
+
+    return attempts
+
+
+def selfcheck_chapters() -> list[BaseChapter]:
+    return [*chapters, HardDeadlineChapter(), NoDeadlineChapter(), NoTasksChapter()]
+
+
+def check_scores() -> int:
+    # calculate_task_score and calculate_batch_score on the same attempts
+    selected = selfcheck_chapters()
+    rnd = Random("selfcheck")
+    debtors = set(range(1, USERS + 1, 7))
+
+    mismatches = 0
+    for chapter in selected:
+        attempts = make_attempts(chapter, rnd)
+        python = python_scores(chapter, attempts, debtors)
+        batch = batch_scores(chapter, attempts, debtors)
+
+        for key in sorted(python.keys() | batch.keys()):
+            # Tasks having attempts without any score are the same as no attempts
+            expected = python.get(key, (False, None))
+            if batch.get(key, (False, None)) != expected:
+                mismatches += 1
+                logger.error(
+                    "Score mismatch for %s: python=%s, batch=%s",
+                    key,
+                    expected,
+                    batch.get(key),
+                )
+
+    # The SQL counterpart needs a database, it is compared on the same attempts
+    # by manage verify-scores --synthetic. Here it must at least build.
+    task_score_query(selected, with_debt=True).compile(dialect=postgresql.dialect())
+
+    logger.info("Compared scores of %d chapters", len(selected))
+    return mismatches
+
+
+def check_golden() -> int:
+    # Variants of the committed recording must not change. Starts are not
+    # blocked until the recording is committed.
+    if not golden.GOLDEN_PATH.exists():
+        logger.warning("No golden outputs in %s, skipped", golden.GOLDEN_PATH)
+        return 0
+
+    golden.use_golden_config()
+    return golden.verify_recording(golden.GOLDEN_PATH, None, 5)
+
+
+def main() -> None:
+    mismatches = check_scores() + check_golden()
+    if mismatches:
+        raise SystemExit(f"Found {mismatches} failed checks")
+
+    logger.info("All checks passed")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
+
+
+__all__ = ["batch_scores", "make_attempts", "python_scores", "selfcheck_chapters"]
@@ -0,0 +1,112 @@
+import contextlib
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Iterator, Mapping
+
+from sqlalchemy import Float, cast, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql.expression import true
+from starlette.exceptions import HTTPException
+from starlette.requests import Request
+from starlette.responses import Response
+
+from quirck.auth.model import User
+from quirck.web.template import TemplateResponse
+
+from networking.core.model import Job, JobKind, JobState
+from networking.core.util import variant_cache
+
+PERCENTILES = [0.5, 0.9, 0.99]
+
+
+class Timings:
+    # Seconds spent in each phase, repeated phases are summed up
+
+    def __init__(self, phases: Mapping[str, float] | None = None):
+        self.phases = dict(phases or {})
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = (
+                self.phases.get(name, 0.0) + time.perf_counter() - start
+            )
+
+    def as_json(self) -> dict[str, float]:
+        return {name: round(seconds, 4) for name, seconds in self.phases.items()}
+
+
+@dataclass
+class PhaseStats:
+    chapter: str
+    action: str
+    phase: str
+    count: int
+    percentiles: list[float]
+
+
+async def load_phase_stats(session: AsyncSession, days: int) -> list[PhaseStats]:
+    phases = (
+        func.jsonb_each_text(Job.timings)
+        .table_valued("key", "value")
+        .render_derived(name="phase")
+    )
+    seconds = cast(phases.c.value, Float)
+
+    rows = await session.execute(
+        select(
+            Job.chapter,
+            Job.kind,
+            Job.check,
+            phases.c.key,
+            func.count(),
+            *[func.percentile_cont(q).within_group(seconds) for q in PERCENTILES],
+        )
+        .select_from(Job)
+        .join(phases, true())
+        .where(Job.state == JobState.DONE)
+        .where(Job.finished > func.now() - timedelta(days=days))
+        .group_by(Job.chapter, Job.kind, Job.check, phases.c.key)
+        .order_by(Job.chapter, Job.kind, Job.check, phases.c.key)
+    )
+
+    return [
+        PhaseStats(
+            chapter=chapter,
+            action=check if kind == JobKind.CHECK else kind.value,
+            phase=phase,
+            count=count,
+            percentiles=list(percentiles),
+        )
+        for chapter, kind, check, phase, count, *percentiles in rows
+    ]
+
+
+async def timings_page(request: Request) -> Response:
+    user: User = request.scope["user"]
+    if not user.is_admin:
+        raise HTTPException(403)
+
+    session: AsyncSession = request.scope["db"]
+
+    days = request.query_params.get("days", "7")
+    if not days.isdigit():
+        raise HTTPException(400)
+
+    return TemplateResponse(
+        request,
+        "timings.html",
+        {
+            "days": int(days),
+            "percentiles": PERCENTILES,
+            "stats": await load_phase_stats(session, int(days)),
+            "variant_cache": variant_cache,
+        },
+    )
+
+
+__all__ = ["Timings", "timings_page"]
@@ -1,14 +1,18 @@
 import functools
+from collections import OrderedDict
+from hashlib import sha256
 from random import Random
-from typing import Awaitable, Callable, ParamSpec, TypeVar
+from types import MappingProxyType
+from typing import Any, Awaitable, Callable, Generic, Hashable, ParamSpec, TypeVar
 
 from netaddr import EUI, IPAddress, IPNetwork
 from netaddr.ip import BaseIP
 from starlette.requests import Request
 
-from networking.core.config import SOCKET_PATH
+from networking.core.config import SECRET_SEED, SOCKET_PATH, VARIANT_CACHE_SIZE
 
 Args = ParamSpec("Args")
+K = TypeVar("K", bound=Hashable)
 T = TypeVar("T")
 
 
@@ -73,6 +77,48 @@ def socket_volume() -> dict[str, str]:
     return {SOCKET_PATH: "/var/run/quirck.sock"}
 
 
+@functools.cache
+def seed_fingerprint() -> str:
+    # Variants depend on the seed, but it must not end up in cache keys as is
+    return sha256(str(SECRET_SEED).encode("utf-8")).hexdigest()[:16]
+
+
+class LRUCache(Generic[K, T]):
+    def __init__(self, size: int):
+        self.size = size
+        self.items: OrderedDict[K, T] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: K) -> T | None:
+        if key not in self.items:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.items.move_to_end(key)
+        return self.items[key]
+
+    def put(self, key: K, value: T) -> None:
+        self.items[key] = value
+        self.items.move_to_end(key)
+        if len(self.items) > self.size:
+            self.items.popitem(last=False)
+
+
+def freeze(value: Any) -> Any:
+    # Read-only copy of JSON-like data
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+# Variants shared between requests and jobs of the process
+variant_cache: LRUCache[tuple[str, int, str], Any] = LRUCache(VARIANT_CACHE_SIZE)
+
+
 def scope_cached(key: str):
     def inner(func: Callable[Args, Awaitable[T]]) -> Callable[Args, Awaitable[T]]:
         @functools.wraps(func)
@@ -109,5 +155,9 @@ __all__ = [
     "generate_address",
     "generate_distinct",
     "socket_volume",
+    "seed_fingerprint",
+    "LRUCache",
+    "freeze",
     "scope_cached",
+    "variant_cache",
 ]
@@ -0,0 +1,75 @@
+import json
+import logging
+from collections import Counter
+from typing import Any
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from quirck.auth.model import User
+
+from networking.core.chapter.base import BaseChapter
+from networking.core.model import VariantSnapshot
+
+logger = logging.getLogger(__name__)
+
+# Key of the audit entry counting users with the same variant as a whole
+WHOLE_VARIANT = "*"
+
+
+async def precompute_variants(
+    session: AsyncSession, chapter: BaseChapter, batch_size: int
+) -> dict[int, dict[str, Any]]:
+    # Stores parameters of every user's variant, returns them for the audit
+    user_ids = list(await session.scalars(select(User.id).order_by(User.id)))
+
+    params: dict[int, dict[str, Any]] = {}
+    for start in range(0, len(user_ids), batch_size):
+        rows = [
+            {
+                "user_id": user_id,
+                "chapter": chapter.slug,
+                "version": chapter.variant_version,
+                "params": chapter.generate_params(user_id),
+            }
+            for user_id in user_ids[start : start + batch_size]
+        ]
+
+        statement = insert(VariantSnapshot).values(rows)
+        await session.execute(
+            statement.on_conflict_do_update(
+                index_elements=[VariantSnapshot.user_id, VariantSnapshot.chapter],
+                set_={
+                    "version": statement.excluded.version,
+                    "params": statement.excluded.params,
+                    "created": func.now(),
+                },
+            )
+        )
+        await session.commit()
+
+        params.update((row["user_id"], row["params"]) for row in rows)
+        logger.info("Stored %d %s variants", len(params), chapter.slug)
+
+    return params
+
+
+def audit_variants(params: dict[int, dict[str, Any]]) -> dict[str, int]:
+    # For every parameter, the number of users sharing its value with somebody
+    values: dict[str, Counter[str]] = {}
+    for user_params in params.values():
+        for key, value in user_params.items():
+            values.setdefault(key, Counter())[json.dumps(value)] += 1
+
+        values.setdefault(WHOLE_VARIANT, Counter())[
+            json.dumps(user_params, sort_keys=True)
+        ] += 1
+
+    return {
+        key: sum(count for count in counter.values() if count > 1)
+        for key, counter in values.items()
+    }
+
+
+__all__ = ["audit_variants", "precompute_variants"]
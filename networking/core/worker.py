@@ -0,0 +1,145 @@
+import asyncio
+import logging
+
+from sqlalchemy import select
+
+from quirck.box.docker import lock_meta
+from quirck.box.exception import DockerConflict
+from quirck.box.model import DockerMeta
+
+from networking.chapters import get_chapter
+from networking.core.config import (
+    JOB_CONFLICT_DELAY,
+    JOB_CONFLICT_TIMEOUT,
+    JOB_HEARTBEAT_INTERVAL,
+    JOB_MAX_TRIES,
+    JOB_POLL_INTERVAL,
+    JOB_RETENTION,
+    JOB_STALE_AFTER,
+    WORKER_CONCURRENCY,
+)
+from networking.core.database import create_tables, get_sessionmaker
+from networking.core.job import (
+    claim_job,
+    conflict_expired,
+    finish_job,
+    prune_jobs,
+    recover_jobs,
+    release_meta,
+    requeue_job,
+    touch_jobs,
+)
+from networking.core.model import Job, JobState
+from networking.core.pool import pool_lifespan
+from networking.core.timing import Timings
+
+logger = logging.getLogger(__name__)
+
+
+async def execute_job(job: Job) -> None:
+    state, error = JobState.DONE, None
+    timings = Timings()
+    # Jobs are queued with the user's lock held, follow-ups take it when run
+    locked = not job.follow_up
+    waiting = False
+
+    try:
+        chapter = get_chapter(job.chapter)
+        if chapter is None:
+            raise ValueError(f"Unknown chapter {job.chapter}")
+
+        async with get_sessionmaker()() as session:
+            if job.follow_up:
+                with timings.phase("lock"):
+                    meta = await lock_meta(session, job.user_id, job.chapter, True)
+                    await session.commit()
+                locked = True
+            else:
+                meta = await session.scalar(
+                    select(DockerMeta).where(DockerMeta.user_id == job.user_id)
+                )
+                if meta is None:
+                    raise ValueError(f"User {job.user_id} has no Docker meta")
+
+            await chapter.run_job(session, meta, job, timings)
+    except DockerConflict as exc:
+        if locked:
+            logger.exception("Job %d failed", job.id)
+            state, error = JobState.FAILED, repr(exc)
+        else:
+            # The run being followed, or another job, still holds the lock
+            logger.info("Job %d waits for the lock", job.id)
+            waiting = True
+    except Exception as exc:
+        logger.exception("Job %d failed", job.id)
+        state, error = JobState.FAILED, repr(exc)
+
+    # A fresh session, the job's one may be broken by the failure
+    async with get_sessionmaker()() as session:
+        if waiting and await conflict_expired(session, job.id, JOB_CONFLICT_TIMEOUT):
+            logger.warning("Job %d gave up waiting for the lock", job.id)
+            state, error = JobState.FAILED, "Lock was not released in time"
+            waiting = False
+
+        if not waiting or not await requeue_job(session, job.id, JOB_CONFLICT_DELAY):
+            await finish_job(session, job.id, state, error, timings.as_json())
+        if state == JobState.FAILED and locked:
+            await release_meta(session, [job.user_id])
+        await session.commit()
+
+
+async def run_slot(running: set[int]) -> None:
+    while True:
+        async with get_sessionmaker()() as session:
+            job = await claim_job(session)
+            await session.commit()
+
+        if job is None:
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+            continue
+
+        logger.info(
+            "Running %s job %d for user %d in %s",
+            job.kind.value,
+            job.id,
+            job.user_id,
+            job.chapter,
+        )
+
+        running.add(job.id)
+        try:
+            await execute_job(job)
+        finally:
+            running.discard(job.id)
+
+
+async def maintain(running: set[int]) -> None:
+    while True:
+        try:
+            async with get_sessionmaker()() as session:
+                await touch_jobs(session, running)
+                await recover_jobs(session, JOB_STALE_AFTER, JOB_MAX_TRIES)
+                await prune_jobs(session, JOB_RETENTION)
+                await session.commit()
+        except Exception:
+            logger.exception("Cannot maintain the job queue")
+
+        await asyncio.sleep(JOB_HEARTBEAT_INTERVAL)
+
+
+async def main() -> None:
+    await create_tables()
+
+    running: set[int] = set()
+    async with pool_lifespan(), asyncio.TaskGroup() as group:
+        group.create_task(maintain(running))
+        for _ in range(WORKER_CONCURRENCY):
+            group.create_task(run_slot(running))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
+
+
+__all__ = ["execute_job"]
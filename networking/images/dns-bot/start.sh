@@ -2,6 +2,11 @@
 
 set -e
 
+# Containers from the warm pool get their environment when claimed
+if [[ -f /run/box.env ]]; then
+    source /run/box.env
+fi
+
 export INTERFACE=eth0
 export RUST_LOG=info
 export RUST_BACKTRACE=full
@@ -0,0 +1,30 @@
+document.addEventListener("DOMContentLoaded", function() {
+    const status = document.querySelector("[data-events]");
+    if (!status) {
+        return;
+    }
+
+    const source = new EventSource(status.dataset.events);
+    // The job may have finished before the stream connected
+    let active = status.dataset.state === "queued" || status.dataset.state === "running";
+
+    source.addEventListener("status", function(ev) {
+        const job = JSON.parse(ev.data);
+
+        if (job === null || job.state === "done" || job.state === "failed") {
+            source.close();
+            // Reload once to show the new log and score
+            if (active || (job !== null && String(job.id) !== status.dataset.job)) {
+                location.reload();
+            }
+            return;
+        }
+
+        active = true;
+        if (job.state === "queued" && job.position) {
+            status.textContent = `Запрос ожидает в очереди, его номер — ${job.position}.`;
+        } else if (job.state === "running") {
+            status.textContent = job.kind === "check" ? "Идёт проверка…" : "Задание активируется…";
+        }
+    });
+});